@@ -1,6 +1,13 @@
-from .store import Store
+from .store import Store, KeyInfo
+from .client import ClientConfig
 from .exc import *
 from .aws import S3Raw
 from .gcp import GSRaw
+from .budget import ByteBudget
+from .latency import LatencyRecorder
+from .cache import *
 from .composite import Composite
+from .hashed import *
 from .sha1 import *
+from .alias import *
+from .sync import *
@@ -0,0 +1,213 @@
+import os
+import re
+import mmap
+import heapq
+import struct
+from typing import Iterable
+from contextlib import suppress
+
+from epic.logging import class_logger
+
+from .store import Store
+from .exc import NotFoundInStore
+from .hashed import HashFormatMixin, hash_hex_length
+
+__all__ = ['AliasIndex', 'AliasIndexStore', 'AliasComposite']
+
+
+class AliasIndex:
+    """
+    A compact on-disk sorted table, mapping digests of one hash algorithm (aliases) to digests of another.
+
+    Records are fixed-size pairs of raw digests, sorted by the alias, so a lookup is a binary search
+    over a memory-mapped file, without loading the table into memory.
+    """
+    MAGIC = b'EBAI'
+    VERSION = 1
+    _HEADER = struct.Struct('<4sBBB')
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._mmap = None
+        self._mmap_pid = None
+        self._n_records = 0
+        with open(self.path, 'rb') as f:
+            header = f.read(self._HEADER.size)
+        if len(header) != self._HEADER.size:
+            raise ValueError(f"{self.path} is not an alias index")
+        magic, version, self.alias_size, self.target_size = self._HEADER.unpack(header)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"{self.path} is not an alias index (or has an unsupported version)")
+        self.record_size = self.alias_size + self.target_size
+
+    @classmethod
+    def build(cls, path, pairs: Iterable[tuple[str, str]], chunk_size=1_000_000) -> 'AliasIndex':
+        """
+        Build an index file from an iterable of (alias, target) hex digest pairs.
+        When an alias appears more than once, the last target is kept.
+
+        The pairs are sorted externally: every `chunk_size` pairs are sorted and written to a temporary file next to
+        the index, and the sorted runs are then merged. Memory use is therefore bounded by the chunk size (roughly
+        200 bytes per pair), and not by the total number of pairs.
+        """
+        path = os.fspath(path)
+        run_paths = []
+        try:
+            table = {}
+            alias_size = target_size = None
+            for alias, target in pairs:
+                alias, target = bytes.fromhex(alias), bytes.fromhex(target)
+                if alias_size is None:
+                    alias_size, target_size = len(alias), len(target)
+                elif (len(alias), len(target)) != (alias_size, target_size):
+                    raise ValueError("all aliases and all targets in an index must be of the same length")
+                table[alias] = target
+                if len(table) >= chunk_size:
+                    run_paths.append(f"{path}.run{len(run_paths)}")
+                    with open(run_paths[-1], 'wb') as f:
+                        f.writelines(alias + table[alias] for alias in sorted(table))
+                    table = {}
+            if alias_size is None:
+                alias_size = target_size = 0
+            runs = [cls._read_run(run_path, alias_size + target_size) for run_path in run_paths]
+            runs.append(alias + table[alias] for alias in sorted(table))
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(cls._HEADER.pack(cls.MAGIC, cls.VERSION, alias_size, target_size))
+                # merging is stable, so of records with the same alias, the one from the latest run comes last
+                previous = None
+                for record in heapq.merge(*runs, key=lambda record: record[:alias_size]):
+                    if previous is not None and record[:alias_size] != previous[:alias_size]:
+                        f.write(previous)
+                    previous = record
+                if previous is not None:
+                    f.write(previous)
+            os.replace(tmp_path, path)
+        finally:
+            for run_path in run_paths:
+                with suppress(FileNotFoundError):
+                    os.remove(run_path)
+        return cls(path)
+
+    @staticmethod
+    def _read_run(run_path, record_size):
+        with open(run_path, 'rb') as f:
+            while record := f.read(record_size):
+                yield record
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_mmap'] = None
+        d['_mmap_pid'] = None
+        return d
+
+    def __len__(self):
+        return self._mapped()[1]
+
+    def _mapped(self) -> tuple[mmap.mmap, int]:
+        if self._mmap_pid != os.getpid():
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # the number of records is taken from the mapped file, which stays valid if the path is replaced
+            self._n_records = (len(self._mmap) - self._HEADER.size) // self.record_size if self.record_size else 0
+            self._mmap_pid = os.getpid()
+        return self._mmap, self._n_records
+
+    def lookup(self, alias: str) -> str | None:
+        """Return the target hex digest for an alias hex digest, or None if it is not in the index."""
+        try:
+            key = bytes.fromhex(alias)
+        except ValueError:
+            return None
+        if len(key) != self.alias_size:
+            return None
+        (table, n_records), header_size, record_size = self._mapped(), self._HEADER.size, self.record_size
+        lo, hi = 0, n_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = header_size + mid * record_size
+            record_alias = table[offset:offset + self.alias_size]
+            if record_alias < key:
+                lo = mid + 1
+            elif record_alias > key:
+                hi = mid
+            else:
+                return table[offset + self.alias_size:offset + record_size].hex()
+        return None
+
+
+class AliasIndexStore(HashFormatMixin, Store):
+    """
+    A store mapping an alias digest (e.g. md5 or sha256) to the canonical digest (e.g. sha1), encoded as ascii bytes.
+    """
+    logger = class_logger
+
+    def __init__(self, index: AliasIndex | str | os.PathLike, algorithm):
+        self._set_algorithm(algorithm)
+        self.index = index if isinstance(index, AliasIndex) else AliasIndex(index)
+        if self.index.alias_size and self.index.alias_size * 2 != hash_hex_length(self.algorithm):
+            raise ValueError(f"the aliases in {self.index.path} are not {self.algorithm} digests")
+
+    def get(self, digest):
+        self._check_valid(digest)
+        if (target := self.index.lookup(digest)) is None:
+            raise NotFoundInStore(self, digest)
+        return target.encode()
+
+
+class AliasComposite(Store):
+    """
+    A store resolving a digest of any configured hash algorithm to a canonical store, using alias stores.
+
+    URIs are either <algorithm>://<hex digest>, or a bare hex digest, in which case the algorithm is inferred
+    from its length (the first matching configured algorithm is used).
+    """
+    logger = class_logger
+    URI_HINT = "<hex digest> or <algorithm>://<hex digest>"
+    _URI_REGEX = re.compile("^(?:([0-9a-z_]+)://)?([0-9a-fA-F]+)$")
+
+    def __init__(self, canonical_store: Store, canonical_algorithm='sha1'):
+        self.canonical_store = canonical_store
+        self.canonical_algorithm = canonical_algorithm.lower()
+        self.aliases: dict[str, Store] = {}
+
+    def append_alias(self, alias_store: Store, algorithm=None):
+        algorithm = (algorithm or getattr(alias_store, 'algorithm', None) or '').lower()
+        if not algorithm:
+            raise ValueError(f"cannot determine the hash algorithm of {alias_store}")
+        hash_hex_length(algorithm)
+        if algorithm == self.canonical_algorithm:
+            raise ValueError(f"{algorithm} is the canonical algorithm and cannot be aliased")
+        self.aliases[algorithm] = alias_store
+
+    def _parse(self, uri):
+        if not isinstance(uri, str) or (match := re.match(self._URI_REGEX, uri)) is None:
+            return None
+        algorithm, digest = match.groups()
+        algorithms = [self.canonical_algorithm, *self.aliases] if algorithm is None else [algorithm]
+        for algorithm in algorithms:
+            if (algorithm == self.canonical_algorithm or algorithm in self.aliases) and \
+                    len(digest) == hash_hex_length(algorithm):
+                return algorithm, digest.lower()
+        return None
+
+    def is_valid(self, uri):
+        return self._parse(uri) is not None
+
+    def resolve(self, uri) -> str:
+        """Return the canonical digest for a URI."""
+        self._check_valid(uri)
+        algorithm, digest = self._parse(uri)
+        if algorithm == self.canonical_algorithm:
+            return digest
+        try:
+            return self.aliases[algorithm].get(digest).decode()
+        except NotFoundInStore as exc:
+            raise NotFoundInStore(self, uri) from exc
+
+    def get(self, uri):
+        canonical = self.resolve(uri)
+        try:
+            return self.canonical_store.get(canonical)
+        except NotFoundInStore as exc:
+            raise NotFoundInStore(self, uri) from exc
@@ -1,31 +1,78 @@
 import os
 import re
-from typing import Iterable
+import time
+from typing import Iterable, Literal
 from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
 
 from epic.common.general import to_list
 from epic.logging import class_logger
 
-from .store import Store
-from .exc import StoreNotAvailable, NotFoundInStore
+from .store import Store, KeyInfo, ChunksIO, DEFAULT_CHUNK_SIZE
+from .exc import StoreNotAvailable, NotFoundInStore, InvalidURI
+from .client import ClientConfig, DEFAULT_CLIENT_CONFIG, freeze, shared_clients
+from .budget import ByteBudget
 
 ANONYMOUS = 'anonymous'
+EAGER = 'eager'
+DEFERRED = 'deferred'
+
+# error codes indicating that the credentials in use are not sufficient, so the next candidate should be tried
+CREDENTIALS_ERROR_CODES = frozenset({
+    'AccessDenied', 'InvalidAccessKeyId', 'SignatureDoesNotMatch', 'ExpiredToken', 'InvalidToken',
+})
+
+# results of credentials probing, by (class, credentials). this is deliberately not reset on fork, so that forked
+# workers do not need to probe again.
+_probe_results: dict = {}
 
 
 class S3Raw(Store):
     URI_REGEX = "^s3://([^/]+)/(.+)$"
     URI_HINT = "s3://bucket/..."
+    PREFIX_REGEX = "^s3://([^/]+)/(.*)$"
 
     logger = class_logger
 
-    def __init__(self, credentials=None):
+    def __init__(
+            self,
+            credentials=None,
+            config: ClientConfig = DEFAULT_CLIENT_CONFIG,
+            share_client=True,
+            probe: Literal['eager', 'deferred'] = EAGER,
+            probe_ttl: float | None = 600,
+            byte_budget: ByteBudget | None = None,
+    ):
+        """
+        :param credentials: A credentials candidate (kwargs for a boto3 Session, None for the default session or
+            ANONYMOUS), or a list of candidates to be tried in order.
+        :param config: Connection settings for the client.
+        :param share_client: Whether to share a single client per process with other stores using the same
+            credentials and configuration.
+        :param probe: With 'eager', all candidates are tested in parallel on first access, and the first one that
+            has access is used. With 'deferred', the first candidate for which a client can be created is used
+            without testing, and the next candidate is only tried when a request fails due to insufficient access.
+        :param probe_ttl: The number of seconds for which probing results are cached in the process (and inherited
+            by forked processes). None means forever.
+        :param byte_budget: If given, the size of each object is looked up before fetching it, and the fetch waits
+            until it fits in the budget. `get` raises `BlobTooLarge` for objects larger than the whole budget, which
+            should be streamed with `get_chunks` instead; it holds one chunk of the budget at a time.
+        """
+        if probe not in (EAGER, DEFERRED):
+            raise ValueError(f"probe must be either {EAGER!r} or {DEFERRED!r}, not {probe!r}")
         self.credentials = to_list(credentials)
+        self.config = config
+        self.share_client = share_client
+        self.probe = probe
+        self.probe_ttl = probe_ttl
+        self.byte_budget = byte_budget
+        self._candidate_index = 0
         self._cached_s3_client = None
         self._cached_s3_client_initialization_pid = None
 
     @classmethod
-    def anonymous(cls):
-        return cls(ANONYMOUS)
+    def anonymous(cls, **kwargs):
+        return cls(ANONYMOUS, **kwargs)
 
     def __getstate__(self):
         d = self.__dict__.copy()
@@ -37,44 +84,236 @@ class S3Raw(Store):
 
     def get(self, uri):
         self._check_valid(uri)
-        if self._s3_client is None:
-            raise StoreNotAvailable(self)
+        if self.byte_budget is None:
+            return self._get(uri)
+        with self.byte_budget.reserve_blob(self, uri, self.size(uri)):
+            return self._get(uri)
+
+    def _get(self, uri):
+        bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
+
+        def get_object(client):
+            exceptions = client.exceptions
+            try:
+                return client.get_object(Bucket=bucket_name, Key=key_name)["Body"].read()
+            except (exceptions.NoSuchKey, exceptions.InvalidObjectState, exceptions.NoSuchBucket) as exc:
+                self.logger.debug(f"uri {uri} not found", exc_info=True)
+                raise NotFoundInStore(self, uri) from exc
+
+        return self._call(get_object)
+
+    def get_chunks(self, uri, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._check_valid(uri)
+        bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
+
+        def get_body(client):
+            exceptions = client.exceptions
+            try:
+                return client.get_object(Bucket=bucket_name, Key=key_name)["Body"]
+            except (exceptions.NoSuchKey, exceptions.InvalidObjectState, exceptions.NoSuchBucket) as exc:
+                self.logger.debug(f"uri {uri} not found", exc_info=True)
+                raise NotFoundInStore(self, uri) from exc
+
+        body = self._call(get_body)
+        with body:
+            if self.byte_budget is None:
+                yield from body.iter_chunks(chunk_size)
+            else:
+                yield from self.byte_budget.iter_chunks(body.iter_chunks(chunk_size), chunk_size)
+
+    def size(self, uri):
+        self._check_valid(uri)
+        bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
+
+        def head_object(client):
+            try:
+                return client.head_object(Bucket=bucket_name, Key=key_name)['ContentLength']
+            except client.exceptions.ClientError as exc:
+                if exc.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound', 'NoSuchBucket'):
+                    raise NotFoundInStore(self, uri) from exc
+                raise
+
+        return self._call(head_object)
+
+    def exists(self, uri):
+        self._check_valid(uri)
+        bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
+
+        def head_object(client):
+            try:
+                client.head_object(Bucket=bucket_name, Key=key_name)
+            except client.exceptions.ClientError as exc:
+                if exc.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound', 'NoSuchBucket'):
+                    return False
+                raise
+            return True
+
+        return self._call(head_object)
+
+    def iter_keys(self, prefix=''):
+        """Iterate over the objects under a prefix, given as s3://bucket/prefix"""
+        if (match := re.match(self.PREFIX_REGEX, prefix)) is None:
+            raise InvalidURI(self, prefix, hint="s3://bucket/prefix")
+        bucket_name, key_prefix = match.groups()
+        paginator = self._call(lambda client: client.get_paginator('list_objects_v2'))
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=key_prefix):
+            for obj in page.get('Contents', []):
+                yield KeyInfo(f"s3://{bucket_name}/{obj['Key']}", obj['Size'], obj['ETag'].strip('"'))
+
+    def copy_to(self, uri, dest, dest_uri):
+        """
+        Copy within S3 on the server side, using the destination's client (which must be able to read the source).
+        Large objects are copied in parts (UploadPartCopy).
+        """
+        if not isinstance(dest, S3Raw):
+            return False
+        self._check_valid(uri)
+        dest._check_valid(dest_uri)
         bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
-        exceptions = self._s3_client.exceptions
+        dest_bucket_name, dest_key_name = re.match(self.URI_REGEX, dest_uri).groups()
+
+        def copy(client):
+            try:
+                client.copy(
+                    CopySource={'Bucket': bucket_name, 'Key': key_name},
+                    Bucket=dest_bucket_name,
+                    Key=dest_key_name,
+                    ExtraArgs={'ACL': 'private', 'StorageClass': 'STANDARD'},
+                )
+            except client.exceptions.ClientError as exc:
+                if exc.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound', 'NoSuchBucket'):
+                    raise NotFoundInStore(self, uri) from exc
+                raise
+
+        dest._call(copy)
+        return True
+
+    def _call(self, func):
+        """
+        Call `func` with the client. In 'deferred' probing mode, when the request fails on access, it is retried
+        with the next credentials candidates. Since S3 also denies access for a single unreadable bucket or key,
+        the failing candidate is probed, and only given up for later requests when the probe fails too.
+        """
+        client = self._s3_client
+        if client is None:
+            raise StoreNotAvailable(self)
+        candidate_index = self._candidate_index
         try:
-            return self._s3_client.get_object(Bucket=bucket_name, Key=key_name)["Body"].read()
-        except (exceptions.NoSuchKey, exceptions.InvalidObjectState, exceptions.NoSuchBucket) as exc:
-            self.logger.debug(f"uri {uri} not found", exc_info=True)
-            raise NotFoundInStore(self, uri) from exc
+            return func(client)
+        except Exception as exc:
+            if self.probe != DEFERRED or not self._is_credentials_error(exc):
+                raise
+            error = exc
+        if self._probed_client(self.credentials[candidate_index]) is None:
+            self.logger.debug(f"credentials candidate #{candidate_index} has insufficient access, moving on")
+            self._advance_candidate(candidate_index)
+        for index in range(candidate_index + 1, len(self.credentials)):
+            if self.credentials[index - 1] == ANONYMOUS:
+                break
+            if (client := self._client_for(self.credentials[index])) is None:
+                continue
+            try:
+                return func(client)
+            except Exception as exc:
+                if not self._is_credentials_error(exc):
+                    raise
+                error = exc
+        raise error
+
+    @staticmethod
+    def _is_credentials_error(exc):
+        from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError
+        if isinstance(exc, (NoCredentialsError, PartialCredentialsError)):
+            return True
+        return isinstance(exc, ClientError) and exc.response.get('Error', {}).get('Code') in CREDENTIALS_ERROR_CODES
+
+    def _advance_candidate(self, failed_index):
+        if failed_index + 1 >= len(self.credentials) or self.credentials[failed_index] == ANONYMOUS:
+            return
+        # another thread may have already moved on
+        if self._candidate_index == failed_index:
+            self._candidate_index = failed_index + 1
+            self._cached_s3_client_initialization_pid = None
 
     @property
     def _s3_client(self):
         # note: this condition also covers the case of plain not having been initialized
         if self._cached_s3_client_initialization_pid != os.getpid():
-            self._cached_s3_client = self._try_different_credentials(self.credentials)
+            if self.probe == DEFERRED:
+                self._cached_s3_client = self._first_available_client(self._candidate_index)
+            else:
+                self._cached_s3_client = self._try_different_credentials(self.credentials)
             self._cached_s3_client_initialization_pid = os.getpid()
         return self._cached_s3_client
 
     def _try_different_credentials(self, creds: Iterable[dict[str, str] | None]):
+        candidates = []
+        for candidate in creds:
+            candidates.append(candidate)
+            # the anonymous client is always usable, so there is no point in looking further
+            if candidate == ANONYMOUS:
+                break
+        if len(candidates) <= 1:
+            results = [self._probed_client(candidate) for candidate in candidates]
+        else:
+            with ThreadPoolExecutor(len(candidates), thread_name_prefix='S3Raw-probe') as executor:
+                results = list(executor.map(self._probed_client, candidates))
+        return next((client for client in results if client is not None), None)
+
+    def _probed_client(self, creds):
+        client = self._client_for(creds)
+        if client is None or creds == ANONYMOUS:
+            return client
+        key = type(self), freeze(creds)
+        if (result := _probe_results.get(key)) is not None:
+            has_access, probe_time = result
+            if self.probe_ttl is None or time.monotonic() - probe_time < self.probe_ttl:
+                return client if has_access else None
+        has_access = bool(self._test_access(client))
+        _probe_results[key] = has_access, time.monotonic()
+        return client if has_access else None
+
+    def _first_available_client(self, start_index):
+        for index in range(start_index, len(self.credentials)):
+            if (client := self._client_for(self.credentials[index])) is not None:
+                self._candidate_index = index
+                return client
+
+    def _client_for(self, creds):
+        if self.share_client:
+            return shared_clients.get(('s3', freeze(creds), self.config), lambda: self._create_client(creds))
+        return self._create_client(creds)
+
+    def _create_client(self, creds):
         # we don't want to import in the module level, for when this dependency is not installed and this class not used
         import boto3
 
-        for creds in creds:
-            if creds == ANONYMOUS:
-                return self._anonymous_client()
-            kwargs = {} if creds is None else creds
-            client = None
-            with suppress(Exception):
-                client = boto3.Session(**kwargs).client("s3")
-            if client is not None and self._test_access(client):
-                return client
+        if creds == ANONYMOUS:
+            return self._anonymous_client()
+        kwargs = {} if creds is None else creds
+        with suppress(Exception):
+            return boto3.Session(**kwargs).client("s3", config=self._botocore_config())
 
-    @staticmethod
-    def _anonymous_client():
+    def _anonymous_client(self):
         from botocore import UNSIGNED
         from botocore.config import Config
         from botocore.session import Session
-        return Session().create_client('s3', config=Config(signature_version=UNSIGNED))
+        config = Config(signature_version=UNSIGNED).merge(self._botocore_config())
+        return Session().create_client('s3', config=config)
+
+    def _botocore_config(self):
+        from botocore.config import Config
+        kwargs = dict(
+            max_pool_connections=self.config.max_pool_connections,
+            tcp_keepalive=self.config.tcp_keepalive,
+        )
+        if self.config.connect_timeout is not None:
+            kwargs['connect_timeout'] = self.config.connect_timeout
+        if self.config.read_timeout is not None:
+            kwargs['read_timeout'] = self.config.read_timeout
+        if self.config.max_attempts is not None:
+            kwargs['retries'] = {'total_max_attempts': self.config.max_attempts, 'mode': 'standard'}
+        return Config(**kwargs)
 
     # note: override this method for better verification that credentials are sufficient
     def _test_access(self, client):
@@ -84,13 +323,22 @@ class S3Raw(Store):
 
     def put(self, uri, data):
         self._check_valid(uri)
-        if self._s3_client is None:
-            raise StoreNotAvailable(self)
         bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
-        self._s3_client.put_object(
+        self._call(lambda client: client.put_object(
             Bucket=bucket_name,
             Key=key_name,
             Body=data,
             ACL='private',
             StorageClass='STANDARD',
-        )
+        ))
+
+    def put_chunks(self, uri, chunks):
+        """Upload a stream of chunks, in parts when it is large, without holding it in memory at once."""
+        self._check_valid(uri)
+        bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
+        self._call(lambda client: client.upload_fileobj(
+            ChunksIO(chunks),
+            Bucket=bucket_name,
+            Key=key_name,
+            ExtraArgs={'ACL': 'private', 'StorageClass': 'STANDARD'},
+        ))
@@ -0,0 +1,98 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from .exc import BlobTooLarge
+
+__all__ = ['ByteBudget']
+
+
+class ByteBudget:
+    """
+    Limits the total number of bytes being fetched at the same time, across threads.
+
+    Fetches wait in order of arrival until their size fits in the budget. Whole blobs larger than the budget are
+    refused (see `reserve_blob`), and should be streamed in chunks instead.
+
+    Share a single instance between stores to get a process-wide budget. When pickled (e.g. sent to a worker
+    process), the copy is a separate budget of the same size.
+    """
+    def __init__(self, max_bytes: int):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+        self._waiters = deque()
+        # the number of whole-blob reservations held by each thread
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+    def acquire(self, n_bytes: int) -> int:
+        """Wait until `n_bytes` fit in the budget and reserve them. Returns the number of bytes actually reserved."""
+        n_bytes = min(max(n_bytes, 0), self.max_bytes)
+        ticket = object()
+        with self._condition:
+            self._waiters.append(ticket)
+            try:
+                self._condition.wait_for(
+                    lambda: self._waiters[0] is ticket and self.in_flight + n_bytes <= self.max_bytes
+                )
+            finally:
+                self._waiters.remove(ticket)
+                # the next waiter may fit as well
+                self._condition.notify_all()
+            self.in_flight += n_bytes
+            self.peak = max(self.peak, self.in_flight)
+        return n_bytes
+
+    def release(self, n_bytes: int):
+        with self._condition:
+            self.in_flight -= n_bytes
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, n_bytes: int):
+        reserved = self.acquire(n_bytes)
+        try:
+            yield reserved
+        finally:
+            self.release(reserved)
+
+    @contextmanager
+    def reserve_blob(self, store, uri, n_bytes: int):
+        """
+        Reserve room for a whole blob, raising `BlobTooLarge` if it can never fit in the budget.
+        Chunks iterated by the same thread while the reservation is held are covered by it.
+        """
+        if n_bytes > self.max_bytes:
+            raise BlobTooLarge(store, uri, n_bytes, self.max_bytes)
+        with self.reserve(n_bytes) as reserved:
+            self._local.n_blobs = getattr(self._local, 'n_blobs', 0) + 1
+            try:
+                yield reserved
+            finally:
+                self._local.n_blobs -= 1
+
+    def iter_chunks(self, chunks, chunk_size: int):
+        """
+        Iterate over chunks of a stream, holding `chunk_size` bytes of the budget while each chunk is being read
+        and processed by the consumer.
+        """
+        if getattr(self._local, 'n_blobs', 0):
+            yield from chunks
+            return
+        iterator = iter(chunks)
+        while True:
+            with self.reserve(chunk_size):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                yield chunk
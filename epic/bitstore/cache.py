@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+
+from epic.logging import class_logger
+
+from .store import Store
+from .exc import NotFoundInStore
+
+__all__ = ['AdmissionPolicy', 'MemoryCache']
+
+
+class AdmissionPolicy:
+    """
+    Decides whether a blob found in a slower tier is promoted into a cache level.
+
+    :param max_size: Blobs larger than this number of bytes are not admitted.
+    :param min_hits: A blob is only admitted once it was found in slower tiers this number of times.
+    :param max_tracked: The maximal number of URIs for which hits are counted (least recently seen are dropped).
+    """
+    def __init__(self, max_size: int | None = None, min_hits: int = 1, max_tracked: int = 100_000):
+        self.max_size = max_size
+        self.min_hits = min_hits
+        self.max_tracked = max_tracked
+        self._hits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_hits'] = OrderedDict()
+        del d['_lock']
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def admit(self, uri, data) -> bool:
+        if self.max_size is not None and len(data) > self.max_size:
+            return False
+        if self.min_hits <= 1:
+            return True
+        with self._lock:
+            hits = self._hits.pop(uri, 0) + 1
+            if hits >= self.min_hits:
+                return True
+            self._hits[uri] = hits
+            while len(self._hits) > self.max_tracked:
+                self._hits.popitem(last=False)
+        return False
+
+
+class MemoryCache(Store):
+    """
+    An in-process LRU store, bounded by the total size of its blobs. It is empty when unpickled.
+    """
+    logger = class_logger
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._contents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_contents'] = OrderedDict()
+        d['used_bytes'] = 0
+        del d['_lock']
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._contents)
+
+    def is_valid(self, uri):
+        return isinstance(uri, str)
+
+    def get(self, uri):
+        self._check_valid(uri)
+        with self._lock:
+            try:
+                self._contents.move_to_end(uri)
+            except KeyError:
+                raise NotFoundInStore(self, uri) from None
+            return self._contents[uri]
+
+    def exists(self, uri):
+        self._check_valid(uri)
+        return uri in self._contents
+
+    def size(self, uri):
+        self._check_valid(uri)
+        try:
+            return len(self._contents[uri])
+        except KeyError:
+            raise NotFoundInStore(self, uri) from None
+
+    def put(self, uri, data):
+        self._check_valid(uri)
+        data = bytes(data)
+        if len(data) > self.max_bytes:
+            self.logger.debug(f"{uri} is larger than the cache, not caching it")
+            return
+        with self._lock:
+            if (previous := self._contents.pop(uri, None)) is not None:
+                self.used_bytes -= len(previous)
+            self._contents[uri] = data
+            self.used_bytes += len(data)
+            while self.used_bytes > self.max_bytes:
+                _, evicted = self._contents.popitem(last=False)
+                self.used_bytes -= len(evicted)
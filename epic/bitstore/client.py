@@ -0,0 +1,76 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+__all__ = ['ClientConfig']
+
+
+@dataclass(frozen=True)
+class ClientConfig:
+    """
+    Connection settings for the clients of cloud-backed stores (S3Raw, GSRaw).
+
+    A value of None leaves the corresponding setting at the default of the underlying SDK.
+    """
+    max_pool_connections: int = 100
+    tcp_keepalive: bool = False
+    connect_timeout: float | None = None
+    read_timeout: float | None = None
+    max_attempts: int | None = None
+
+
+DEFAULT_CLIENT_CONFIG = ClientConfig()
+
+
+def freeze(obj) -> Hashable:
+    """Convert an object (e.g. a dict of credentials) into a hashable key, to be used for client sharing."""
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(x) for x in obj)
+    try:
+        hash(obj)
+    except TypeError:
+        return type(obj), id(obj)
+    return obj
+
+
+class _SharedClients:
+    """
+    A per-process registry of clients, so that multiple store instances with the same credentials
+    and configuration use a single client (and a single connection pool).
+    """
+    def __init__(self):
+        self._pid = None
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, factory: Callable):
+        with self._lock:
+            # clients cannot be safely used across a fork, so we start afresh in each process
+            if self._pid != os.getpid():
+                self._clients.clear()
+                self._locks.clear()
+                self._pid = os.getpid()
+            if key in self._clients:
+                return self._clients[key]
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        # create outside the registry lock, so that slow client creation does not block unrelated keys
+        with key_lock:
+            with self._lock:
+                if key in self._clients:
+                    return self._clients[key]
+            client = factory()
+            with self._lock:
+                self._clients[key] = client
+            return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._locks.clear()
+
+
+shared_clients = _SharedClients()
@@ -1,21 +1,121 @@
+import os
+import time
+import threading
+from typing import Literal
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, TimeoutError as FutureTimeoutError
+
 from epic.logging import class_logger
 
 from .store import Store
-from .exc import NotFoundInStore, StoreNotAvailable
+from .exc import NotFoundInStore, StoreNotAvailable, ReplicationError, DeadlineExceeded
+from .cache import AdmissionPolicy
+from .latency import LatencyRecorder
+
+ALL = 'all'
+QUORUM = 'quorum'
+PRIMARY = 'primary'
+
+# the number of pooled threads for gets with a deadline; more concurrent gets run on threads of their own
+GET_WORKERS = 32
+# the maximum number of such extra threads, beyond which sources are skipped as if they missed their deadline
+MAX_OVERFLOW_GETS = 256
+
+
+class PutReport:
+    """
+    The per-tier results of a Composite put.
+
+    Tiers which are still being written to in the background are in `pending`; call `wait` to wait for them.
+    """
+    def __init__(self, uri):
+        self.uri = uri
+        self.succeeded: list[Store] = []
+        self.failed: dict[Store, BaseException] = {}
+        self.pending: dict[Store, Future] = {}
+
+    def _collect(self, store, future: Future):
+        self.pending.pop(store, None)
+        if (error := future.exception()) is None:
+            self.succeeded.append(store)
+        else:
+            self.failed[store] = error
+
+    def wait(self, timeout=None) -> 'PutReport':
+        for store, future in list(self.pending.items()):
+            future.exception(timeout)
+            self._collect(store, future)
+        return self
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} {self.uri!r}: {len(self.succeeded)} succeeded, {len(self.failed)} failed, "
+            f"{len(self.pending)} pending>"
+        )
 
 
 class Composite(Store):
     logger = class_logger
 
-    def __init__(self):
+    def __init__(
+            self,
+            replication: Literal['all', 'quorum', 'primary'] = ALL,
+            quorum: int | None = None,
+            max_pending_writes: int = 1000,
+    ):
+        """
+        :param replication: How `put` writes to the write targets:
+            'all' - write to all targets in parallel, and fail if any of them fails.
+            'quorum' - write to all targets in parallel, and return once `quorum` of them succeed
+                (the rest continue in the background).
+            'primary' - write to the first target, and replicate to the rest in the background.
+        :param quorum: The number of successful writes required for the 'quorum' policy (default: a majority).
+        :param max_pending_writes: The maximum number of tier writes in flight, including background replication.
+            Each pending write holds its data in memory, so once this is reached, `put` blocks until a write is done.
+        """
+        if replication not in (ALL, QUORUM, PRIMARY):
+            raise ValueError(f"unknown replication policy {replication!r}")
         self.sources: list[Store] = []
         self.cache_back: set[int] = set()
         self.cache: Store | None = None
+        # (level, admission policy) pairs, rather than a mapping by id, so that they survive pickling
+        self.cache_levels: list[tuple[Store, AdmissionPolicy | None]] = []
+        self.write_targets: list[Store] = []
+        self.replication = replication
+        self.quorum = quorum
+        self.max_pending_writes = max_pending_writes
+        self._write_slots = threading.Semaphore(max_pending_writes)
+        self.latencies = LatencyRecorder()
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        self._executors_pid = None
+        self._executors_lock = threading.Lock()
+        self._pooled_gets = 0
+        self._overflow_gets = 0
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_executors'] = {}
+        d['_executors_pid'] = None
+        d['_pooled_gets'] = 0
+        d['_overflow_gets'] = 0
+        del d['_executors_lock']
+        del d['_write_slots']
+        return d
 
-    def append_source(self, source: Store, cache_result=False):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._executors_lock = threading.Lock()
+        self._write_slots = threading.Semaphore(self.max_pending_writes)
+
+    def append_source(self, source: Store, cache_result=False, write=False):
         self.sources.append(source)
         if cache_result:
             self.cache_back.add(id(source))
+        if write:
+            self.write_targets.append(source)
+
+    def append_target(self, target: Store):
+        """Add a write-only tier, which is written to by `put` but not read from."""
+        self.write_targets.append(target)
 
     def append_cache(self, cache: Store, read=True):
         if read:
@@ -23,23 +123,225 @@ class Composite(Store):
         if self.cache is not None:
             self.logger.warning(f"replacing configured cache {self.cache} with {cache}")
         self.cache = cache
-    
+
+    def append_cache_level(self, cache: Store, admission: AdmissionPolicy | None = None):
+        """
+        Add a level to the cache hierarchy. Levels are read in order with the other sources, and a blob found
+        in any later source is promoted into all the levels before it, subject to each level's admission policy.
+        Unlike `append_cache`, any number of levels can be added.
+        """
+        self.sources.append(cache)
+        self.cache_levels.append((cache, admission))
+
     def is_valid(self, uri):
         return any(store.is_valid(uri) for store in self.sources)
-    
-    def get(self, uri):
+
+    def get(self, uri, deadline: float | None = None):
+        """
+        :param deadline: A time budget in seconds for the whole get. The remaining budget is split evenly between
+            the sources left to try, and a source which does not respond within its share is abandoned (its call
+            continues in the background) in favour of the next one. Nested composites get their share as their own
+            deadline. Raises `DeadlineExceeded` when the budget runs out, or when the blob is not found and
+            some source was abandoned. Once `MAX_OVERFLOW_GETS` abandoned calls are still running beyond the pool,
+            sources are abandoned right away until some of them finish.
+
+        The latency of each get is recorded in `latencies` under the key 'get', and the time spent on each
+        source under the source itself.
+        """
         self._check_valid(uri)
-        for store in self.sources:
-            if not store.is_valid(uri):
-                continue
+        start = time.monotonic()
+        try:
+            return self._get(uri, deadline, start)
+        finally:
+            self.latencies.record('get', time.monotonic() - start)
+
+    def _get(self, uri, deadline, start):
+        stores = [store for store in self.sources if store.is_valid(uri)]
+        missed_levels = []
+        abandoned = False
+        for i, store in enumerate(stores):
+            timeout = None
+            if deadline is not None:
+                remaining = deadline - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise DeadlineExceeded(self, uri, deadline)
+                timeout = remaining / (len(stores) - i)
             try:
-                data = store.get(uri)
-            except (NotFoundInStore, StoreNotAvailable):
+                data = self._get_from(store, uri, timeout)
+            except NotFoundInStore:
+                missed_levels.extend((level, admission) for level, admission in self.cache_levels if level is store)
+                continue
+            except StoreNotAvailable:
+                continue
+            except DeadlineExceeded:
+                abandoned = True
                 continue
             if id(store) in self.cache_back and self.cache is not None and store is not self.cache:
                 self._write_to_cache(data, uri)
+            if missed_levels:
+                self._promote(missed_levels, data, uri)
             return data
+        if abandoned:
+            raise DeadlineExceeded(self, uri, deadline)
         raise NotFoundInStore(self, uri)
-    
+
+    def _get_from(self, store, uri, timeout):
+        start = time.monotonic()
+        try:
+            if timeout is None:
+                return store.get(uri)
+            if isinstance(store, Composite):
+                return store.get(uri, deadline=timeout)
+            try:
+                return self._submit_get(store, uri, timeout).result(timeout)
+            except FutureTimeoutError:
+                self.logger.debug(f"abandoning {store} after {timeout:.3f}s getting {uri}")
+                raise DeadlineExceeded(store, uri, timeout) from None
+        finally:
+            self.latencies.record(store, time.monotonic() - start)
+
+    def exists(self, uri):
+        self._check_valid(uri)
+        for store in self.sources:
+            if not store.is_valid(uri):
+                continue
+            try:
+                if store.exists(uri):
+                    return True
+            except StoreNotAvailable:
+                continue
+        return False
+
     def _write_to_cache(self, data, uri):
         self.cache.put(uri, data)
+
+    def _promote(self, levels, data, uri):
+        for level, admission in levels:
+            if admission is not None and not admission.admit(uri, data):
+                continue
+            try:
+                level.put(uri, data)
+            except Exception:
+                self.logger.debug(f"failed promoting {uri} into {level}, ignoring", exc_info=True)
+
+    def put(self, uri, data) -> PutReport:
+        if not self.write_targets:
+            return super().put(uri, data)
+        targets = [target for target in self.write_targets if target.is_valid(uri)]
+        if not targets:
+            self._check_valid(uri)
+            raise ReplicationError(self, uri, {'write targets': 'none is valid for this uri'})
+        report = PutReport(uri)
+        if self.replication == PRIMARY:
+            primary, *replicas = targets
+            try:
+                primary.put(uri, data)
+            except Exception as exc:
+                report.failed[primary] = exc
+                raise ReplicationError(self, uri, report.failed, report) from exc
+            report.succeeded.append(primary)
+            self._replicate_in_background(report, replicas, data)
+            return report
+        futures = {self._submit_put(target, uri, data): target for target in targets}
+        required = len(targets) if self.replication == ALL else self._required_quorum(len(targets))
+        for future in as_completed(futures):
+            report._collect(futures[future], future)
+            if len(report.succeeded) >= required:
+                break
+            if len(targets) - len(report.failed) < required:
+                self._track_remaining(report, futures)
+                raise ReplicationError(self, uri, report.failed, report)
+        self._track_remaining(report, futures)
+        return report
+
+    def _track_remaining(self, report, futures):
+        for future, target in futures.items():
+            if target in report.succeeded or target in report.failed:
+                continue
+            if future.done():
+                report._collect(target, future)
+            else:
+                self._track_in_background(report, target, future)
+
+    def _required_quorum(self, n_targets):
+        if self.quorum is None:
+            return n_targets // 2 + 1
+        return min(self.quorum, n_targets)
+
+    def _replicate_in_background(self, report, targets, data):
+        for target in targets:
+            self._track_in_background(report, target, self._submit_put(target, report.uri, data))
+
+    def _track_in_background(self, report, target, future):
+        report.pending[target] = future
+        future.add_done_callback(lambda f: self._log_background_write(target, report.uri, f))
+
+    def _log_background_write(self, target, uri, future):
+        if (error := future.exception()) is not None:
+            self.logger.warning(f"background replication of {uri} to {target} failed: {error!r}")
+
+    def _submit_put(self, target, uri, data) -> Future:
+        self._write_slots.acquire()
+        try:
+            future = self._executor('put').submit(target.put, uri, data)
+        except BaseException:
+            self._write_slots.release()
+            raise
+        future.add_done_callback(lambda f: self._write_slots.release())
+        return future
+
+    def _submit_get(self, store, uri, timeout) -> Future:
+        # an abandoned get holds its thread until the store returns, so gets are never queued behind busy threads:
+        # when all the pooled threads are busy, the get runs on a thread of its own, up to MAX_OVERFLOW_GETS of them
+        executor = self._executor('get', GET_WORKERS)
+        with self._executors_lock:
+            pooled = self._pooled_gets < GET_WORKERS
+            overflow = not pooled and self._overflow_gets < MAX_OVERFLOW_GETS
+            if pooled:
+                self._pooled_gets += 1
+            elif overflow:
+                self._overflow_gets += 1
+        if pooled:
+            future = executor.submit(store.get, uri)
+            future.add_done_callback(self._release_pooled_get)
+        elif overflow:
+            future = self._run_in_thread(store.get, uri)
+            future.add_done_callback(self._release_overflow_get)
+        else:
+            self.logger.warning(f"too many abandoned gets are still running, skipping {store} for {uri}")
+            raise DeadlineExceeded(store, uri, timeout)
+        return future
+
+    def _release_pooled_get(self, future):
+        with self._executors_lock:
+            self._pooled_gets -= 1
+
+    def _release_overflow_get(self, future):
+        with self._executors_lock:
+            self._overflow_gets -= 1
+
+    @staticmethod
+    def _run_in_thread(fn, *args) -> Future:
+        future = Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        threading.Thread(target=run, name='Composite-get', daemon=True).start()
+        return future
+
+    def _executor(self, kind, max_workers=None) -> ThreadPoolExecutor:
+        # puts and gets use separate pools, so that slow writes don't eat into the deadlines of gets
+        with self._executors_lock:
+            if self._executors_pid != os.getpid():
+                self._executors = {}
+                self._executors_pid = os.getpid()
+                self._pooled_gets = 0
+                self._overflow_gets = 0
+            if kind not in self._executors:
+                self._executors[kind] = ThreadPoolExecutor(max_workers, thread_name_prefix=f'Composite-{kind}')
+            return self._executors[kind]
@@ -0,0 +1,320 @@
+"""
+A local blob-serving daemon, so that many worker processes on a node share a single store
+(and with it, its caches, connection pools and in-flight fetches).
+
+The server hosts a configured store (e.g. a Sha1Composite) on a Unix socket. Workers use a `BlobClient`, which is a
+drop-in `Store` replacement. Large blobs are handed over through shared memory instead of the socket.
+
+Run a server with:
+    python -m epic.bitstore.daemon /path/to/socket my_package.my_module:make_store
+
+where `make_store` is a callable returning the store to serve. This module requires Unix domain sockets.
+"""
+import os
+import re
+import socket
+import struct
+import argparse
+import importlib
+import threading
+import socketserver
+from concurrent.futures import Future
+from contextlib import suppress
+from multiprocessing import shared_memory, resource_tracker
+
+from epic.logging import class_logger
+
+from .store import Store
+from .exc import NotFoundInStore, StoreNotAvailable, InvalidURI, RemoteStoreError
+
+__all__ = ['BlobServer', 'BlobClient']
+
+OP_GET = 1
+OP_IS_VALID = 2
+OP_EXISTS = 3
+
+STATUS_OK = 0
+STATUS_SHARED_MEMORY = 1
+STATUS_NOT_FOUND = 2
+STATUS_INVALID = 3
+STATUS_NOT_AVAILABLE = 4
+STATUS_ERROR = 5
+
+_REQUEST_HEADER = struct.Struct('!BI')
+_RESPONSE_HEADER = struct.Struct('!BQ')
+_ACK = b'\x06'
+
+DEFAULT_SHARED_MEMORY_THRESHOLD = 1 << 20
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        n_read = sock.recv_into(view[received:], n - received)
+        if n_read == 0:
+            raise ConnectionError("connection closed")
+        received += n_read
+    return bytes(buf)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    server: 'BlobServer'
+
+    def handle(self):
+        while True:
+            try:
+                op, uri_length = _REQUEST_HEADER.unpack(_recv_exactly(self.request, _REQUEST_HEADER.size))
+                uri = _recv_exactly(self.request, uri_length).decode()
+            except ConnectionError:
+                return
+            try:
+                self._handle(op, uri)
+            except ConnectionError:
+                # the client went away (e.g. it timed out), which is not an error of the server
+                return
+
+    def _handle(self, op, uri):
+        if op == OP_IS_VALID:
+            self._respond(STATUS_OK, b'\x01' if self.server.store.is_valid(uri) else b'\x00')
+        elif op == OP_GET:
+            self._handle_get(uri)
+        elif op == OP_EXISTS:
+            self._handle_exists(uri)
+        else:
+            self._respond(STATUS_ERROR, f"unknown operation {op}".encode())
+
+    def _handle_exists(self, uri):
+        try:
+            exists = self.server.store.exists(uri)
+        except Exception as exc:
+            return self._respond_error(uri, exc)
+        self._respond(STATUS_OK, b'\x01' if exists else b'\x00')
+
+    def _handle_get(self, uri):
+        try:
+            data = self.server.fetch(uri)
+        except Exception as exc:
+            return self._respond_error(uri, exc)
+        if len(data) < self.server.shared_memory_threshold:
+            return self._respond(STATUS_OK, data)
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        # ownership of the shared memory is handed over to the client, which unlinks it after copying the data
+        # noinspection PyProtectedMember
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        try:
+            shm.buf[:len(data)] = data
+            self._respond(STATUS_SHARED_MEMORY, struct.pack('!Q', len(data)) + shm.name.encode())
+            _recv_exactly(self.request, len(_ACK))
+        except BaseException:
+            # the client may not have taken ownership, so we take it back
+            # noinspection PyProtectedMember
+            resource_tracker.register(shm._name, 'shared_memory')
+            with suppress(FileNotFoundError):
+                shm.unlink()
+            raise
+        finally:
+            shm.close()
+
+    def _respond_error(self, uri, exc):
+        if isinstance(exc, InvalidURI):
+            return self._respond(STATUS_INVALID, b'')
+        if isinstance(exc, NotFoundInStore):
+            return self._respond(STATUS_NOT_FOUND, b'')
+        if isinstance(exc, StoreNotAvailable):
+            return self._respond(STATUS_NOT_AVAILABLE, b'')
+        self.server.logger.debug(f"failed serving {uri}", exc_info=True)
+        self._respond(STATUS_ERROR, repr(exc).encode())
+
+    def _respond(self, status, payload):
+        self.request.sendall(_RESPONSE_HEADER.pack(status, len(payload)) + payload)
+
+
+class BlobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve a store over a Unix socket. Concurrent requests for the same URI are deduplicated into a single fetch.
+
+    :param store: The store to serve.
+    :param socket_path: The path of the Unix socket. An existing file at this path is replaced.
+    :param shared_memory_threshold: Blobs of at least this number of bytes are handed over in shared memory.
+    """
+    daemon_threads = True
+    # many workers may connect at once
+    request_queue_size = socket.SOMAXCONN
+    logger = class_logger
+
+    def __init__(self, store: Store, socket_path, shared_memory_threshold=DEFAULT_SHARED_MEMORY_THRESHOLD):
+        self.store = store
+        self.shared_memory_threshold = shared_memory_threshold
+        self._in_flight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        socket_path = os.fspath(socket_path)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+
+    def fetch(self, uri):
+        with self._lock:
+            future = self._in_flight.get(uri)
+            leader = future is None
+            if leader:
+                future = self._in_flight[uri] = Future()
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(self.store.get(uri))
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                del self._in_flight[uri]
+        return future.result()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class BlobClient(Store):
+    """
+    A store fetching from a `BlobServer` running on the same node. Each thread uses its own connection.
+
+    `is_valid` is checked locally, without contacting the server: a URI is valid if it matches `uri_regex`, or if
+    no regex is given, if it is a string. Pass the format of the served store's URIs when the client is a tier in a
+    composite, so that other URIs are not sent to the server.
+    """
+    logger = class_logger
+
+    def __init__(self, socket_path, timeout: float | None = None, uri_regex: str | re.Pattern | None = None):
+        self.socket_path = os.fspath(socket_path)
+        self.timeout = timeout
+        self.uri_regex = uri_regex
+        self._local = threading.local()
+        self._sockets = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        for attr in ['_local', '_sockets', '_lock']:
+            del d[attr]
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._sockets = []
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close the connections of all threads."""
+        with self._lock:
+            for sock in self._sockets:
+                sock.close()
+            self._sockets.clear()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.socket_path!r})"
+
+    def is_valid(self, uri):
+        if not isinstance(uri, str):
+            return False
+        return self.uri_regex is None or re.match(self.uri_regex, uri) is not None
+
+    def get(self, uri):
+        status, payload = self._request(OP_GET, uri)
+        if status == STATUS_OK:
+            return payload
+        if status == STATUS_SHARED_MEMORY:
+            return self._read_shared_memory(payload)
+        self._raise_error(uri, status, payload)
+
+    def exists(self, uri):
+        status, payload = self._request(OP_EXISTS, uri)
+        if status == STATUS_OK:
+            return payload == b'\x01'
+        self._raise_error(uri, status, payload)
+
+    def _raise_error(self, uri, status, payload):
+        if status == STATUS_NOT_FOUND:
+            raise NotFoundInStore(self, uri)
+        if status == STATUS_INVALID:
+            raise InvalidURI(self, uri)
+        if status == STATUS_NOT_AVAILABLE:
+            raise StoreNotAvailable(self)
+        raise RemoteStoreError(self, uri, payload.decode(errors='replace'))
+
+    def _read_shared_memory(self, payload):
+        size = struct.unpack('!Q', payload[:8])[0]
+        shm = shared_memory.SharedMemory(name=payload[8:].decode())
+        try:
+            data = bytes(shm.buf[:size])
+        finally:
+            shm.close()
+            shm.unlink()
+            try:
+                self._socket.sendall(_ACK)
+            except OSError as exc:
+                self._drop_socket()
+                raise StoreNotAvailable(self) from exc
+        return data
+
+    @property
+    def _socket(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as exc:
+                sock.close()
+                self.logger.debug(f"failed connecting to {self.socket_path}", exc_info=True)
+                raise StoreNotAvailable(self) from exc
+            with self._lock:
+                self._sockets.append(sock)
+            self._local.socket = sock
+            self._local.pid = os.getpid()
+        return self._local.socket
+
+    def _request(self, op, uri):
+        if not isinstance(uri, str):
+            raise TypeError(f"uri must be a string, not {type(uri).__name__}")
+        encoded = uri.encode()
+        sock = self._socket
+        try:
+            sock.sendall(_REQUEST_HEADER.pack(op, len(encoded)) + encoded)
+            status, length = _RESPONSE_HEADER.unpack(_recv_exactly(sock, _RESPONSE_HEADER.size))
+            return status, _recv_exactly(sock, length)
+        except (OSError, ConnectionError) as exc:
+            self._drop_socket()
+            raise StoreNotAvailable(self) from exc
+
+    def _drop_socket(self):
+        # the connection is in an unknown state (e.g. a response may still arrive), so it is closed, which also
+        # tells the server that nobody is waiting, and the next request reconnects
+        sock = self._local.socket
+        self._local.pid = None
+        with self._lock:
+            with suppress(ValueError):
+                self._sockets.remove(sock)
+        sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m epic.bitstore.daemon', description=__doc__.split('\n\n')[0])
+    parser.add_argument('socket_path', help="path of the Unix socket to listen on")
+    parser.add_argument('factory', help="module:callable returning the store to serve")
+    parser.add_argument(
+        '--shared-memory-threshold', type=int, default=DEFAULT_SHARED_MEMORY_THRESHOLD,
+        help="blobs of at least this number of bytes are handed over in shared memory",
+    )
+    args = parser.parse_args(argv)
+    module_name, _, factory_name = args.factory.partition(':')
+    store = getattr(importlib.import_module(module_name), factory_name)()
+    with BlobServer(store, args.socket_path, args.shared_memory_threshold) as server:
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-__all__ = ['StoreNotAvailable', 'NotFoundInStore', 'InvalidURI']
+from typing import Any
+
+__all__ = ['StoreNotAvailable', 'NotFoundInStore', 'InvalidURI', 'ReplicationError', 'RemoteStoreError', 'DeadlineExceeded', 'BlobTooLarge']
 
 
 class ParameterizedException(Exception):
@@ -27,3 +29,29 @@ class InvalidURI(ParameterizedException):
         hint_str = '' if hint is None else f' (hint: {hint})'
         self._params = store_class_name, uri, hint_str
         super().__init__(f"URI '{uri}' is invalid for {store_class_name}{hint_str}", store_class_name, uri, hint)
+
+
+class ReplicationError(ParameterizedException):
+    def __init__(self, store, uri, failures: dict[Any, BaseException | str], report=None):
+        failures = {str(tier): str(error) for tier, error in failures.items()}
+        details = '; '.join(f"{tier}: {error}" for tier, error in failures.items())
+        super().__init__(f"{store} failed to replicate '{uri}' ({details})", str(store), str(uri), failures)
+        self.report = report
+
+
+class RemoteStoreError(ParameterizedException):
+    def __init__(self, store, uri, error):
+        super().__init__(f"{store} failed fetching '{uri}': {error}", str(store), str(uri), str(error))
+
+
+class DeadlineExceeded(ParameterizedException):
+    def __init__(self, store, uri, deadline):
+        super().__init__(f"{store} failed to get '{uri}' within {deadline}s", str(store), str(uri), deadline)
+
+
+class BlobTooLarge(ParameterizedException):
+    def __init__(self, store, uri, size, max_bytes):
+        super().__init__(
+            f"'{uri}' in {store} is {size} bytes, more than the byte budget of {max_bytes} bytes (use get_chunks)",
+            str(store), str(uri), size, max_bytes,
+        )
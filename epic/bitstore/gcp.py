@@ -3,8 +3,10 @@ import re
 
 from epic.logging import class_logger
 
-from .store import Store
-from .exc import StoreNotAvailable, NotFoundInStore
+from .store import Store, KeyInfo, DEFAULT_CHUNK_SIZE
+from .exc import StoreNotAvailable, NotFoundInStore, InvalidURI
+from .client import ClientConfig, DEFAULT_CLIENT_CONFIG, freeze, shared_clients
+from .budget import ByteBudget
 
 ANONYMOUS = 'anonymous'
 
@@ -12,17 +14,28 @@ ANONYMOUS = 'anonymous'
 class GSRaw(Store):
     URI_REGEX = "^gs://([^/]+)/(.+)$"
     URI_HINT = "gs://bucket/..."
+    PREFIX_REGEX = "^gs://([^/]+)/(.*)$"
 
     logger = class_logger
 
-    def __init__(self, credentials=None):
+    def __init__(
+            self,
+            credentials=None,
+            config: ClientConfig = DEFAULT_CLIENT_CONFIG,
+            share_client=True,
+            byte_budget: ByteBudget | None = None,
+    ):
         self.credentials = credentials
+        self.config = config
+        self.share_client = share_client
+        # see S3Raw for the semantics of byte_budget
+        self.byte_budget = byte_budget
         self._cached_gs_client = None
         self._cached_gs_client_initialization_pid = None
 
     @classmethod
-    def anonymous(cls):
-        return cls(ANONYMOUS)
+    def anonymous(cls, **kwargs):
+        return cls(ANONYMOUS, **kwargs)
 
     def __getstate__(self):
         d = self.__dict__.copy()
@@ -41,11 +54,82 @@ class GSRaw(Store):
         bucket = self._gs_client.bucket(bucket_name)
         blob = bucket.blob(path)
         try:
-            return blob.download_as_bytes()
+            if self.byte_budget is None:
+                return blob.download_as_bytes(**self._request_kwargs())
+            with self.byte_budget.reserve_blob(self, uri, self.size(uri)):
+                return blob.download_as_bytes(**self._request_kwargs())
         except exceptions.NotFound as exc:
             self.logger.debug(f"uri {uri} not found", exc_info=True)
             raise NotFoundInStore(self, uri) from exc
 
+    def get_chunks(self, uri, chunk_size=DEFAULT_CHUNK_SIZE):
+        from google.cloud import exceptions
+        self._check_valid(uri)
+        bucket_name, path = re.match(self.URI_REGEX, uri).groups()
+        if self._gs_client is None:
+            raise StoreNotAvailable(self)
+        blob = self._gs_client.bucket(bucket_name).blob(path)
+        try:
+            with blob.open('rb', chunk_size=chunk_size, **self._request_kwargs()) as reader:
+                chunks = iter(lambda: reader.read(chunk_size), b'')
+                if self.byte_budget is not None:
+                    chunks = self.byte_budget.iter_chunks(chunks, chunk_size)
+                yield from chunks
+        except exceptions.NotFound as exc:
+            self.logger.debug(f"uri {uri} not found", exc_info=True)
+            raise NotFoundInStore(self, uri) from exc
+
+    def exists(self, uri):
+        self._check_valid(uri)
+        bucket_name, path = re.match(self.URI_REGEX, uri).groups()
+        if self._gs_client is None:
+            raise StoreNotAvailable(self)
+        return self._gs_client.bucket(bucket_name).blob(path).exists(**self._request_kwargs())
+
+    def size(self, uri):
+        self._check_valid(uri)
+        bucket_name, path = re.match(self.URI_REGEX, uri).groups()
+        if self._gs_client is None:
+            raise StoreNotAvailable(self)
+        blob = self._gs_client.bucket(bucket_name).get_blob(path, **self._request_kwargs())
+        if blob is None:
+            raise NotFoundInStore(self, uri)
+        return blob.size
+
+    def iter_keys(self, prefix=''):
+        """Iterate over the objects under a prefix, given as gs://bucket/prefix"""
+        if (match := re.match(self.PREFIX_REGEX, prefix)) is None:
+            raise InvalidURI(self, prefix, hint="gs://bucket/prefix")
+        bucket_name, path_prefix = match.groups()
+        if self._gs_client is None:
+            raise StoreNotAvailable(self)
+        for blob in self._gs_client.list_blobs(bucket_name, prefix=path_prefix, **self._request_kwargs()):
+            yield KeyInfo(f"gs://{bucket_name}/{blob.name}", blob.size, blob.etag)
+
+    def copy_to(self, uri, dest, dest_uri):
+        """Copy within GCS on the server side (using rewrite), with the destination's client."""
+        from google.cloud import exceptions
+        if not isinstance(dest, GSRaw):
+            return False
+        self._check_valid(uri)
+        dest._check_valid(dest_uri)
+        bucket_name, path = re.match(self.URI_REGEX, uri).groups()
+        dest_bucket_name, dest_path = re.match(self.URI_REGEX, dest_uri).groups()
+        if dest._gs_client is None:
+            raise StoreNotAvailable(dest)
+        source_blob = dest._gs_client.bucket(bucket_name).blob(path)
+        dest_blob = dest._gs_client.bucket(dest_bucket_name).blob(dest_path)
+        token = None
+        try:
+            # large objects may take several calls to rewrite
+            while True:
+                token, _, _ = dest_blob.rewrite(source_blob, token=token, **dest._request_kwargs())
+                if token is None:
+                    break
+        except exceptions.NotFound as exc:
+            raise NotFoundInStore(self, uri) from exc
+        return True
+
     @property
     def _gs_client(self):
         # note: this condition also covers the case of plain not having been initialized
@@ -55,36 +139,97 @@ class GSRaw(Store):
                     f"recreating _gs_client, was created in {self._cached_gs_client_initialization_pid} "
                     f"and we are in {os.getpid()}"
                 )
-            from google.cloud import storage
-            try:
-                if self.credentials == ANONYMOUS:
-                    client = storage.Client.create_anonymous_client()
-                else:
-                    client_kwargs = {'credentials': self.credentials}
-                    if self.credentials is not None:
-                        client_kwargs['project'] = self.credentials.project_id
-                    client = storage.Client(**client_kwargs)
-            except Exception:
-                self.logger.debug(f"failed to create client, this data source will not be available", exc_info=True)
-                client = None
+            if self.share_client:
+                client = shared_clients.get(('gs', freeze(self.credentials), self.config), self._create_client)
             else:
-                self._configure_connection_pool_size(client)
+                client = self._create_client()
             self._cached_gs_client = client
             self._cached_gs_client_initialization_pid = os.getpid()
         return self._cached_gs_client
 
-    @staticmethod
-    def _configure_connection_pool_size(client):
-        from requests.adapters import HTTPAdapter
+    def _create_client(self):
+        from google.cloud import storage
+        try:
+            if self.credentials == ANONYMOUS:
+                client = storage.Client.create_anonymous_client()
+            else:
+                client_kwargs = {'credentials': self.credentials}
+                if self.credentials is not None:
+                    client_kwargs['project'] = self.credentials.project_id
+                client = storage.Client(**client_kwargs)
+        except Exception:
+            self.logger.debug(f"failed to create client, this data source will not be available", exc_info=True)
+            return None
+        self._configure_connection_pool(client)
+        return client
+
+    def _configure_connection_pool(self, client):
         # the default connection pool size is 10, not enough for high-scale work
         # noinspection PyProtectedMember
-        client._http.mount("https://", HTTPAdapter(pool_maxsize=100))
+        client._http.mount("https://", self._http_adapter())
         # noinspection PyProtectedMember
-        client._http_internal.mount("https://", HTTPAdapter(pool_maxsize=100))
+        client._http_internal.mount("https://", self._http_adapter())
+
+    def _http_adapter(self):
+        import socket
+        from requests.adapters import HTTPAdapter
+        from urllib3.connection import HTTPConnection
+        from urllib3.util.retry import Retry
+
+        class ConfiguredHTTPAdapter(HTTPAdapter):
+            def __init__(self, socket_options=None, **kwargs):
+                # must be set before calling super().__init__, which initializes the pool manager
+                self.socket_options = socket_options
+                super().__init__(**kwargs)
+
+            def init_poolmanager(self, *args, **kwargs):
+                if self.socket_options is not None:
+                    kwargs['socket_options'] = self.socket_options
+                super().init_poolmanager(*args, **kwargs)
+
+        socket_options = None
+        if self.config.tcp_keepalive:
+            socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        max_retries = 0
+        if self.config.max_attempts is not None:
+            max_retries = Retry(
+                total=self.config.max_attempts - 1,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,
+                raise_on_status=False,
+            )
+        return ConfiguredHTTPAdapter(
+            socket_options=socket_options,
+            pool_maxsize=self.config.max_pool_connections,
+            max_retries=max_retries,
+        )
+
+    def _request_kwargs(self):
+        if self.config.connect_timeout is None and self.config.read_timeout is None:
+            return {}
+        # the google client's default timeout is 60 seconds for both connect and read
+        return {'timeout': (
+            60 if self.config.connect_timeout is None else self.config.connect_timeout,
+            60 if self.config.read_timeout is None else self.config.read_timeout,
+        )}
 
     def put(self, uri, data):
         self._check_valid(uri)
         if self._gs_client is None:
             raise StoreNotAvailable(self)
         bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
-        self._gs_client.bucket(bucket_name).blob(key_name).upload_from_string(data)
+        self._gs_client.bucket(bucket_name).blob(key_name).upload_from_string(data, **self._request_kwargs())
+
+    def put_chunks(self, uri, chunks):
+        """
+        Upload a stream of chunks with a resumable upload, without holding it in memory at once.
+        The upload is cancelled if the stream fails.
+        """
+        self._check_valid(uri)
+        if self._gs_client is None:
+            raise StoreNotAvailable(self)
+        bucket_name, key_name = re.match(self.URI_REGEX, uri).groups()
+        with self._gs_client.bucket(bucket_name).blob(key_name).open('wb', **self._request_kwargs()) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
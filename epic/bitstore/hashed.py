@@ -0,0 +1,333 @@
+import io
+import re
+import queue
+import random
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from itertools import product
+from concurrent.futures import ThreadPoolExecutor
+
+from epic.logging import class_logger
+
+from .store import Store, DEFAULT_CHUNK_SIZE
+from .exc import NotFoundInStore, InvalidURI
+from .composite import Composite
+
+__all__ = [
+    'hash_hex_length', 'HashFormatMixin', 'InvalidDataFound', 'VerifyHashMixin', 'HashStore', 'HashAPISource',
+    'HashComposite', 'HashCache',
+]
+
+
+@lru_cache
+def hasher_factory(algorithm: str):
+    """Return a callable creating a new hash object for the given algorithm."""
+    if algorithm == 'blake3':
+        # we don't want to import in the module level, for when this dependency is not installed and not used
+        from blake3 import blake3
+        return blake3
+    if (constructor := getattr(hashlib, algorithm, None)) is not None and algorithm in hashlib.algorithms_available:
+        return constructor
+    try:
+        hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError(f"unsupported hash algorithm {algorithm!r}") from None
+    return lambda data=b'': hashlib.new(algorithm, data)
+
+
+@lru_cache
+def hash_hex_length(algorithm: str) -> int:
+    """The length of the hex digest of the given algorithm."""
+    if algorithm == 'blake3':
+        return 64
+    return hasher_factory(algorithm)().digest_size * 2
+
+
+@lru_cache
+def _hex_regex(algorithm: str):
+    return re.compile(f"^[0-9a-fA-F]{{{hash_hex_length(algorithm)}}}$")
+
+
+class HashFormatMixin:
+    """
+    Validate that URIs are hex digests of a hash algorithm.
+    The algorithm is either set by subclasses using `ALGORITHM` or per instance.
+    """
+    ALGORITHM: str | None = None
+    URI_HINT = "<hex digest>"
+
+    @property
+    def algorithm(self) -> str:
+        return getattr(self, '_algorithm', None) or self.ALGORITHM
+
+    def _set_algorithm(self, algorithm):
+        algorithm = (algorithm or self.ALGORITHM or '').lower()
+        if not algorithm:
+            raise ValueError(f"{self.__class__.__name__} requires a hash algorithm")
+        # fail early on unsupported algorithms
+        hash_hex_length(algorithm)
+        self._algorithm = algorithm
+
+    def is_valid(self, uri):
+        return re.match(_hex_regex(self.algorithm), uri) is not None
+
+
+class InvalidDataFound(NotFoundInStore):
+    """Data found in store appears to be invalid"""
+
+
+class VerifyHashMixin:
+    logger = class_logger
+    ALGORITHM: str | None = None
+    verify = False
+    # verify a random sample of 1 in `verify_every` fetched blobs (puts are always verified)
+    verify_every = 1
+
+    @property
+    def algorithm(self) -> str:
+        # also defined here, for stores using this mixin without HashFormatMixin
+        return getattr(self, '_algorithm', None) or self.ALGORITHM
+
+    def _should_verify(self):
+        return self.verify and (self.verify_every <= 1 or random.randrange(self.verify_every) == 0)
+
+    def _verify_data(self, data, digest):
+        self._verify_hash(hasher_factory(self.algorithm)(data), digest)
+        return data
+
+    def _verify_chunks(self, chunks, digest):
+        """
+        Collect data from an iterable of chunks, hashing each chunk as it arrives.
+        This overlaps hashing with the download, and since hashlib releases the GIL for large buffers,
+        it does not hold back other threads. The chunks are written into a single growing buffer, which is
+        returned without copying, so the blob is not held twice in memory.
+        """
+        buffer = io.BytesIO()
+        for chunk in self._verified_chunks(chunks, digest):
+            buffer.write(chunk)
+        return buffer.getvalue()
+
+    def _verified_chunks(self, chunks, digest):
+        """
+        Pass chunks through while hashing them, and raise `InvalidDataFound` after the last one if the data is
+        invalid (so that a consumer streaming the chunks somewhere can abort).
+        """
+        hasher = hasher_factory(self.algorithm)()
+        for chunk in chunks:
+            hasher.update(chunk)
+            yield chunk
+        self._verify_hash(hasher, digest)
+
+    def _verify_hash(self, hasher, digest):
+        calc_digest = hasher.hexdigest()
+        if digest.lower() != calc_digest:
+            self.logger.warning(
+                f"the provided {self.algorithm} {digest} does not match the calculated {self.algorithm} "
+                f"{calc_digest} of data"
+            )
+            raise InvalidDataFound(self, digest)
+
+
+class HashStore(HashFormatMixin, VerifyHashMixin, Store):
+    """A store of blobs keyed by their hex digest, under a prefix of a base store."""
+    def __init__(self, base_store, prefix, verify=False, verify_every=1, algorithm=None):
+        self._set_algorithm(algorithm)
+        self.base_store = base_store
+        self.prefix = prefix
+        self.verify = verify
+        self.verify_every = verify_every
+
+    def get(self, digest: str):
+        self._check_valid(digest)
+        uri = f"{self.prefix}{digest.lower()}"
+        try:
+            if self._should_verify():
+                return self._verified_get(uri, digest)
+            return self.base_store.get(uri)
+        except InvalidDataFound:
+            raise
+        except NotFoundInStore as exc:
+            raise NotFoundInStore(self, digest) from exc
+
+    def _verified_get(self, uri, digest):
+        # the whole blob ends up in memory, so it takes its size of the base store's byte budget (if it has one)
+        if (budget := getattr(self.base_store, 'byte_budget', None)) is None:
+            return self._verify_chunks(self.base_store.get_chunks(uri), digest)
+        with budget.reserve_blob(self.base_store, uri, self.base_store.size(uri)):
+            return self._verify_chunks(self.base_store.get_chunks(uri), digest)
+
+    def get_chunks(self, digest, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._check_valid(digest)
+        chunks = self.base_store.get_chunks(f"{self.prefix}{digest.lower()}", chunk_size)
+        if self._should_verify():
+            chunks = self._verified_chunks(chunks, digest)
+        try:
+            yield from chunks
+        except InvalidDataFound:
+            raise
+        except NotFoundInStore as exc:
+            raise NotFoundInStore(self, digest) from exc
+
+    def put(self, digest, data):
+        self._check_valid(digest)
+        if self.verify:
+            self._verify_data(data, digest)
+        self.base_store.put(f"{self.prefix}{digest.lower()}", data)
+
+    def put_chunks(self, digest, chunks):
+        self._check_valid(digest)
+        if self.verify:
+            chunks = self._verified_chunks(chunks, digest)
+        self.base_store.put_chunks(f"{self.prefix}{digest.lower()}", chunks)
+
+    def exists(self, digest):
+        self._check_valid(digest)
+        return self.base_store.exists(f"{self.prefix}{digest.lower()}")
+
+    def size(self, digest):
+        self._check_valid(digest)
+        try:
+            return self.base_store.size(f"{self.prefix}{digest.lower()}")
+        except NotFoundInStore as exc:
+            raise NotFoundInStore(self, digest) from exc
+
+    def iter_keys(self, prefix='', shard_digits=1, n_workers=16):
+        """
+        Iterate over the digests in the store starting with `prefix`, with the size and etag of each blob.
+
+        The keyspace is split into 16 ** `shard_digits` sub-prefixes (e.g. 1 for 16, 2 for 256), which are listed in
+        parallel. Results are yielded as they arrive, so they are not ordered. Sharding stops at the full digest
+        length, so a long prefix gets fewer (or no) sub-prefixes.
+        """
+        n_free_digits = hash_hex_length(self.algorithm) - len(prefix)
+        if re.fullmatch('[0-9a-fA-F]*', prefix) is None or n_free_digits < 0:
+            raise InvalidURI(self, prefix, hint=f"prefix of {self.URI_HINT}")
+        prefix = prefix.lower()
+        shard_digits = max(0, min(shard_digits, n_free_digits))
+        shards = [prefix + ''.join(digits) for digits in product('0123456789abcdef', repeat=shard_digits)]
+        yield from self._merge_parallel([self._list_shard(shard) for shard in shards], n_workers)
+
+    def _list_shard(self, shard):
+        for info in self.base_store.iter_keys(f"{self.prefix}{shard}"):
+            digest = info.key[len(self.prefix):]
+            if self.is_valid(digest):
+                yield info._replace(key=digest)
+
+    @staticmethod
+    def _merge_parallel(iterators, n_workers, max_buffered=10_000):
+        results = queue.Queue(max_buffered)
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def consume(iterator):
+            # shards which haven't started when the merge is abandoned are not listed at all
+            if stop.is_set():
+                return
+            try:
+                for item in iterator:
+                    if not put((item, None)):
+                        return
+            except Exception as exc:
+                put((done, exc))
+            else:
+                put((done, None))
+
+        executor = ThreadPoolExecutor(n_workers, thread_name_prefix='HashStore-list')
+        try:
+            for iterator in iterators:
+                executor.submit(consume, iterator)
+            n_remaining = len(iterators)
+            while n_remaining:
+                item, error = results.get()
+                if error is not None:
+                    raise error
+                if item is done:
+                    n_remaining -= 1
+                else:
+                    yield item
+        finally:
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+
+    def copy_to(self, digest, dest, dest_digest):
+        if not isinstance(dest, HashStore) or dest.algorithm != self.algorithm:
+            return False
+        self._check_valid(digest)
+        dest._check_valid(dest_digest)
+        try:
+            return self.base_store.copy_to(
+                f"{self.prefix}{digest.lower()}", dest.base_store, f"{dest.prefix}{dest_digest.lower()}"
+            )
+        except NotFoundInStore as exc:
+            raise NotFoundInStore(self, digest) from exc
+
+
+class HashAPISource(HashFormatMixin, VerifyHashMixin, Store, ABC):
+    def __init__(self, verify=False, verify_every=1, algorithm=None):
+        self._set_algorithm(algorithm)
+        self.verify = verify
+        self.verify_every = verify_every
+
+    def get(self, digest):
+        self._check_valid(digest)
+        data = self.api_get(digest.lower())
+        if data is None:
+            raise NotFoundInStore(self, digest)
+        if self._should_verify():
+            data = self._verify_data(data, digest)
+        return data
+
+    @abstractmethod
+    def api_get(self, digest): pass
+
+
+class HashComposite(HashFormatMixin, Composite):
+    """A composite accepting either <hex digest> or <algorithm>://<hex digest>."""
+    def __init__(self, algorithm=None, **kwargs):
+        super().__init__(**kwargs)
+        self._set_algorithm(algorithm)
+        self._uri_regex = re.compile(f"^(?:{self.algorithm}://)?([0-9a-fA-F]{{{hash_hex_length(self.algorithm)}}})$")
+        self.URI_HINT = f"<{self.algorithm}> or {self.algorithm}://<{self.algorithm}>"
+
+    def is_valid(self, uri):
+        return re.match(self._uri_regex, uri) is not None
+
+    def get(self, uri, deadline=None):
+        self._check_valid(uri)
+        [digest] = re.match(self._uri_regex, uri).groups()
+        return super().get(digest.lower(), deadline)
+
+    def put(self, uri, data):
+        self._check_valid(uri)
+        [digest] = re.match(self._uri_regex, uri).groups()
+        return super().put(digest.lower(), data)
+
+    def exists(self, uri):
+        self._check_valid(uri)
+        [digest] = re.match(self._uri_regex, uri).groups()
+        return super().exists(digest.lower())
+
+
+class HashCache(HashStore):
+    """
+    This is a store which silently ignores put failures.
+    """
+    def put(self, digest, data):
+        try:
+            super().put(digest, data)
+            self.logger.debug(f"saved result of {digest} to binary cache")
+        except InvalidDataFound:
+            self.logger.debug(f"data for {digest} is invalid and cannot be cached, silently ignoring")
+        except Exception:
+            self.logger.debug(f"failed caching blob for {self.algorithm} {digest}, silently ignoring", exc_info=True)
@@ -0,0 +1,49 @@
+import math
+import threading
+from collections import deque, defaultdict
+from typing import Hashable
+
+__all__ = ['LatencyRecorder']
+
+
+class LatencyRecorder:
+    """
+    Keeps the most recent latency samples (in seconds) per key, for computing latency distributions.
+    """
+    def __init__(self, max_samples: int = 10_000):
+        self.max_samples = max_samples
+        self._samples = defaultdict(self._new_samples)
+        self._lock = threading.Lock()
+
+    def _new_samples(self):
+        return deque(maxlen=self.max_samples)
+
+    def __getstate__(self):
+        return {'max_samples': self.max_samples}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_samples'])
+
+    def record(self, key: Hashable, seconds: float):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._samples)
+
+    def count(self, key: Hashable) -> int:
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def percentiles(self, key: Hashable, percentiles=(50, 90, 99)) -> dict[float, float]:
+        """The given percentiles of the recorded samples of a key (nearest-rank). Empty if there are no samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples:
+            return {}
+        return {p: samples[min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))] for p in percentiles}
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
@@ -1,6 +1,49 @@
+import io
 from abc import ABC, abstractmethod
+from typing import NamedTuple, Iterator, Iterable
 
-from .exc import InvalidURI
+from .exc import InvalidURI, NotFoundInStore
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+class KeyInfo(NamedTuple):
+    key: str
+    size: int | None = None
+    etag: str | None = None
+
+
+class ChunksIO(io.RawIOBase):
+    """A readable, non-seekable file object over an iterable of byte chunks, for streaming into upload APIs."""
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def read(self, size=-1):
+        # unlike a raw stream, fill the requested size unless the stream ends, since uploaders size parts by reads
+        if size is None or size < 0:
+            return self.readall()
+        buffer = bytearray(size)
+        with memoryview(buffer) as view:
+            n_read = 0
+            while n_read < size and (n := self.readinto(view[n_read:])):
+                n_read += n
+        del buffer[n_read:]
+        return bytes(buffer)
 
 
 class Store(ABC):
@@ -19,3 +62,32 @@ class Store(ABC):
     # optional
     def put(self, uri, data):
         raise NotImplementedError(f"{self.__class__.__name__} does not implement the 'put' method")
+
+    # optional: stores which can stream data should override this, to allow processing data as it arrives
+    def get_chunks(self, uri, chunk_size=DEFAULT_CHUNK_SIZE):
+        yield self.get(uri)
+
+    # optional: stores which can upload a stream should override this, so that the data is not held in memory at once
+    def put_chunks(self, uri, chunks: Iterable[bytes]):
+        self.put(uri, b''.join(chunks))
+
+    # optional: stores which can check for existence without fetching the data should override this
+    def exists(self, uri) -> bool:
+        try:
+            self.get(uri)
+        except NotFoundInStore:
+            return False
+        return True
+
+    # optional: the size of a blob in bytes, without fetching it
+    def size(self, uri) -> int:
+        raise NotImplementedError(f"{self.__class__.__name__} does not implement the 'size' method")
+
+    # optional: copy a blob to another store without passing the data through this process.
+    # returns False when this is not possible, in which case the caller should get and put the data instead.
+    def copy_to(self, uri, dest: 'Store', dest_uri) -> bool:
+        return False
+
+    # optional: iterate over the keys (with metadata when available) starting with a prefix
+    def iter_keys(self, prefix='') -> Iterator[KeyInfo]:
+        raise NotImplementedError(f"{self.__class__.__name__} does not implement the 'iter_keys' method")
@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from epic.logging import class_logger
+
+from .store import Store
+
+__all__ = ['SyncReport', 'SyncEngine']
+
+
+class SyncReport:
+    """Counters of a sync run. Bytes are only known for blobs streamed through this process."""
+    def __init__(self):
+        self.copied = 0
+        self.server_side = 0
+        self.skipped = 0
+        self.failed: dict[str, BaseException] = {}
+        self.bytes = 0
+        self.start_time = time.monotonic()
+        self.end_time = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    @property
+    def keys_per_second(self) -> float:
+        return (self.copied + self.server_side) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}: {self.copied} streamed ({self.bytes} bytes), {self.server_side} copied "
+            f"server-side, {self.skipped} skipped, {len(self.failed)} failed in {self.elapsed:.1f}s "
+            f"({self.keys_per_second:.1f} keys/s, {self.bytes_per_second / 2 ** 20:.1f} MiB/s)>"
+        )
+
+
+class SyncEngine:
+    """
+    Copy blobs from a source store to a destination store, by key.
+
+    Each key is copied on the server side when both stores support it (e.g. within S3 or within GCS). Otherwise,
+    the blob is streamed through this process, from the source's `get_chunks` into the destination's `put_chunks`
+    (e.g. between S3 and GCS). Stores which can't stream hold whole blobs in memory instead, up to `n_workers` at
+    a time. Keys are processed in parallel.
+
+    :param n_workers: The number of keys copied in parallel.
+    :param skip_existing: Don't copy keys which already exist in the destination.
+    :param server_side: Try copying on the server side before streaming.
+    :param checkpoint: A path of a file recording the keys which were done, so that an interrupted run can be
+        resumed by running again with the same checkpoint.
+    :param log_every: Log progress after this number of keys.
+    """
+    logger = class_logger
+
+    def __init__(
+            self,
+            source: Store,
+            dest: Store,
+            n_workers: int = 16,
+            skip_existing=True,
+            server_side=True,
+            checkpoint: str | os.PathLike | None = None,
+            log_every: int = 10_000,
+    ):
+        self.source = source
+        self.dest = dest
+        self.n_workers = n_workers
+        self.skip_existing = skip_existing
+        self.server_side = server_side
+        self.checkpoint = checkpoint
+        self.log_every = log_every
+        self._lock = threading.Lock()
+
+    def run(self, keys: Iterable[str] | None = None, prefix='') -> SyncReport:
+        """
+        Sync the given keys, or if no keys are given, all the keys in the source starting with `prefix`.
+        """
+        if keys is None:
+            keys = (info.key for info in self.source.iter_keys(prefix))
+        report = SyncReport()
+        done = self._load_checkpoint()
+        checkpoint_file = None if self.checkpoint is None else open(self.checkpoint, 'a')
+        try:
+            with ThreadPoolExecutor(self.n_workers, thread_name_prefix='SyncEngine') as executor:
+                in_flight = set()
+                n_keys = 0
+                for key in keys:
+                    if key in done:
+                        with self._lock:
+                            report.skipped += 1
+                        continue
+                    # keep a bounded number of keys in flight, so that huge key streams are not materialized
+                    if len(in_flight) >= 2 * self.n_workers:
+                        _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    in_flight.add(executor.submit(self._sync_key, key, report, checkpoint_file))
+                    n_keys += 1
+                    if self.log_every and n_keys % self.log_every == 0:
+                        self.logger.info(f"sync progress: {report}")
+                wait(in_flight)
+        finally:
+            if checkpoint_file is not None:
+                checkpoint_file.close()
+            report.end_time = time.monotonic()
+        self.logger.info(f"sync done: {report}")
+        return report
+
+    def _load_checkpoint(self) -> set[str]:
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return set()
+        with open(self.checkpoint) as f:
+            return {line.rstrip('\n') for line in f if line.strip()}
+
+    def _sync_key(self, key, report, checkpoint_file):
+        try:
+            if self.skip_existing and self.dest.exists(key):
+                outcome = 'skipped'
+            elif self.server_side and self.source.copy_to(key, self.dest, key):
+                outcome = 'server_side'
+            else:
+                n_bytes = self._stream(key)
+                outcome = 'copied'
+        except Exception as exc:
+            self.logger.debug(f"failed syncing {key}", exc_info=True)
+            with self._lock:
+                report.failed[key] = exc
+            return
+        with self._lock:
+            setattr(report, outcome, getattr(report, outcome) + 1)
+            if outcome == 'copied':
+                report.bytes += n_bytes
+            if checkpoint_file is not None:
+                checkpoint_file.write(f"{key}\n")
+                checkpoint_file.flush()
+
+    def _stream(self, key) -> int:
+        n_bytes = 0
+
+        def counted(chunks):
+            nonlocal n_bytes
+            for chunk in chunks:
+                n_bytes += len(chunk)
+                yield chunk
+
+        self.dest.put_chunks(key, counted(self.source.get_chunks(key)))
+        return n_bytes
@@ -1,6 +1,8 @@
+import time
 import random
+import threading
 
-from epic.bitstore import Store, NotFoundInStore
+from epic.bitstore import Store, NotFoundInStore, KeyInfo
 
 
 class DictStore(Store):
@@ -24,6 +26,72 @@ class DictStore(Store):
         self._check_valid(uri)
         self.contents[uri] = data
 
+    def iter_keys(self, prefix=''):
+        for key, value in list(self.contents.items()):
+            if key.startswith(prefix):
+                yield KeyInfo(key, len(value), str(hash(value)))
+
+
+class ChunkedDictStore(DictStore):
+    def get_chunks(self, uri, chunk_size=None):
+        # always small chunks, to exercise chunk handling with small blobs
+        chunk_size = 4
+        data = self.get(uri)
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+
+class StreamingDictStore(ChunkedDictStore):
+    """A ChunkedDictStore which records the chunks it was given by put_chunks, and writes nothing on failure"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_chunk_counts = []
+
+    def put_chunks(self, uri, chunks):
+        parts = list(chunks)
+        self.put_chunk_counts.append(len(parts))
+        self.put(uri, b''.join(parts))
+
+
+class BlockingDictStore(DictStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.unblocked = threading.Event()
+
+    def put(self, uri, data):
+        self.unblocked.wait()
+        super().put(uri, data)
+
+
+class SlowDictStore(DictStore):
+    def __init__(self, *args, delay=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+
+    def get(self, uri):
+        time.sleep(self.delay)
+        return super().get(uri)
+
+
+class HangingDictStore(DictStore):
+    """A DictStore whose gets hang until it is unblocked"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.unblocked = threading.Event()
+
+    def get(self, uri):
+        self.unblocked.wait()
+        return super().get(uri)
+
+
+class CopyingDictStore(DictStore):
+    """A DictStore which copies to other DictStores directly, as if on the server side"""
+    def copy_to(self, uri, dest, dest_uri):
+        if not isinstance(dest, DictStore):
+            return False
+        dest.put(dest_uri, self.get(uri))
+        return True
+
 
 class RandomAPI(Store):
     def __init__(self, bases={}, prefix='key'):
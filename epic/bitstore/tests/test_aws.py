@@ -1,13 +1,24 @@
+import io
+import hashlib
+import os
 import json
+import uuid
 import random
 
 import pytest
 from ultima import ultimap
 from epic.common.general import get_single
 
-from epic.bitstore import S3Raw, Composite, NotFoundInStore, InvalidURI, StoreNotAvailable
+from botocore import UNSIGNED
+from botocore.response import StreamingBody
+from botocore.exceptions import ClientError
+from epic.bitstore import (
+    S3Raw, Composite, ClientConfig, SyncEngine, NotFoundInStore, InvalidURI, StoreNotAvailable, ByteBudget,
+    BlobTooLarge, Sha1Store,
+)
+from epic.bitstore.aws import ANONYMOUS
 
-from .helpers import DictStore
+from .helpers import DictStore, ChunkedDictStore
 
 # source: https://registry.opendata.aws/usgs-lidar/
 S3_PUBLIC_CATALOG_URI = "s3://usgs-lidar-stac/ept/catalog.json"
@@ -54,6 +65,11 @@ class TestAws:
         with pytest.raises(StoreNotAvailable):
             s3.put(S3_PUBLIC_CATALOG_URI, b'data')
 
+    def test_exists(self):
+        s3 = S3Raw.anonymous()
+        assert s3.exists(S3_PUBLIC_CATALOG_URI)
+        assert not s3.exists(f"{S3_PUBLIC_CATALOG_URI}_{random.random()}")
+
     def test_put(self):
         s3 = S3Raw.anonymous()
         with pytest.raises(InvalidURI):
@@ -61,6 +77,128 @@ class TestAws:
         with pytest.raises(Exception, match="An error occurred .AccessDenied. when calling the PutObject operation"):
             s3.put(S3_PUBLIC_CATALOG_URI, b'data')
 
+    def test_client_config(self):
+        config = ClientConfig(max_pool_connections=32, tcp_keepalive=True, max_attempts=3)
+        s3 = S3Raw.anonymous(config=config)
+        client_config = s3._s3_client.meta.config
+        assert client_config.max_pool_connections == 32
+        assert client_config.tcp_keepalive
+        assert client_config.retries['total_max_attempts'] == 3
+        # stores with the same credentials and configuration share a client
+        assert S3Raw.anonymous(config=config)._s3_client is s3._s3_client
+        assert S3Raw.anonymous()._s3_client is not s3._s3_client
+        assert S3Raw.anonymous(config=config, share_client=False)._s3_client is not s3._s3_client
+
+    def test_copy_to(self):
+        objects = {('bucket', 'a'): b'data'}
+        source, dest = fake_s3(objects), fake_s3(objects)
+        assert source.copy_to('s3://bucket/a', dest, 's3://other/b')
+        assert objects[('other', 'b')] == b'data'
+        with pytest.raises(NotFoundInStore):
+            source.copy_to('s3://bucket/missing', dest, 's3://other/c')
+        assert not source.copy_to('s3://bucket/a', DictStore(writeable=True, prefix=None), 's3://other/c')
+        with pytest.raises(InvalidURI):
+            source.copy_to('s3://bucket/a', dest, 'other')
+
+    def test_put_chunks(self):
+        s3 = fake_s3()
+        s3.put_chunks('s3://bucket/a', iter([b'ab', b'cd', b'e']))
+        assert s3._s3_client.objects[('bucket', 'a')] == b'abcde'
+
+        def failing():
+            yield b'ab'
+            raise RuntimeError("stream failed")
+
+        with pytest.raises(RuntimeError):
+            s3.put_chunks('s3://bucket/b', failing())
+        assert ('bucket', 'b') not in s3._s3_client.objects
+        source = ChunkedDictStore({f"s3://bucket/{i}": str(i).encode() * 10 for i in range(5)}, prefix=None)
+        report = SyncEngine(source, s3).run()
+        assert report.copied == 5
+        assert s3._s3_client.objects[('bucket', '3')] == b'3' * 10
+
+    def test_byte_budget(self):
+        small, large = b'x' * 100, b'y' * 1000
+        small_digest, large_digest = hashlib.sha1(small).hexdigest(), hashlib.sha1(large).hexdigest()
+        budget = ByteBudget(100)
+        s3 = fake_s3({('bucket', small_digest): small, ('bucket', large_digest): large}, byte_budget=budget)
+        assert s3.size(f's3://bucket/{large_digest}') == 1000
+        assert s3.get(f's3://bucket/{small_digest}') == small
+        with pytest.raises(BlobTooLarge):
+            s3.get(f's3://bucket/{large_digest}')
+        assert b''.join(s3.get_chunks(f's3://bucket/{large_digest}', chunk_size=30)) == large
+        # a verified get holds the whole blob in memory, so it is subject to the budget as well
+        sha1 = Sha1Store(s3, prefix='s3://bucket/', verify=True)
+        assert sha1.get(small_digest) == small
+        with pytest.raises(BlobTooLarge):
+            sha1.get(large_digest)
+        assert b''.join(sha1.get_chunks(large_digest)) == large
+        assert budget.peak == 100
+        assert budget.in_flight == 0
+
+    def test_eager_probing(self):
+        invalid = {'aws_access_key_id': f'invalid_{uuid.uuid4().hex}', 'aws_secret_access_key': 'invalid'}
+        valid = {'aws_access_key_id': f'valid_{uuid.uuid4().hex}', 'aws_secret_access_key': 'valid'}
+        s3 = CountingS3Raw([invalid, valid, ANONYMOUS])
+        client = s3._s3_client
+        assert client is not None
+        assert client.meta.config.signature_version is not UNSIGNED
+        assert sorted(CountingS3Raw.probed) == sorted([invalid['aws_access_key_id'], valid['aws_access_key_id']])
+        # probing results are cached in the process
+        assert CountingS3Raw([invalid, valid])._s3_client is client
+        assert len(CountingS3Raw.probed) == 2
+        assert CountingS3Raw([invalid], probe_ttl=0)._s3_client is None
+        assert len(CountingS3Raw.probed) == 3
+
+    def test_deferred_probing(self):
+        from botocore.exceptions import ClientError
+
+        creds = {'aws_access_key_id': f'deferred_{uuid.uuid4().hex}', 'aws_secret_access_key': 'invalid'}
+        s3 = CountingS3Raw([creds, ANONYMOUS], probe='deferred')
+        client = s3._s3_client
+        assert client.meta.config.signature_version is not UNSIGNED
+        assert creds['aws_access_key_id'] not in CountingS3Raw.probed
+        calls = []
+
+        def request(client):
+            calls.append(client)
+            if len(calls) == 1:
+                raise ClientError({'Error': {'Code': 'InvalidAccessKeyId'}}, 'GetObject')
+            return b'data'
+
+        assert s3._call(request) == b'data'
+        assert calls[0] is client
+        assert calls[1].meta.config.signature_version is UNSIGNED
+        # the candidate failed probing as well, so it is given up for later requests
+        assert creds['aws_access_key_id'] in CountingS3Raw.probed
+        assert s3._candidate_index == 1
+        # the anonymous client is the last resort, so errors are raised
+        calls.clear()
+        with pytest.raises(ClientError):
+            s3._call(request)
+        with pytest.raises(ValueError):
+            S3Raw(probe='sometimes')
+
+    def test_deferred_access_denied(self):
+        from botocore.exceptions import ClientError
+
+        creds = {'aws_access_key_id': f'valid_{uuid.uuid4().hex}', 'aws_secret_access_key': 'valid'}
+        s3 = CountingS3Raw([creds, ANONYMOUS], probe='deferred')
+        client = s3._s3_client
+        calls = []
+
+        def request(client):
+            calls.append(client)
+            if client.meta.config.signature_version is not UNSIGNED:
+                raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetObject')
+            return b'public'
+
+        # a single denied request (e.g. of an unreadable bucket) falls back for that request only
+        assert s3._call(request) == b'public'
+        assert len(calls) == 2
+        assert s3._candidate_index == 0
+        assert s3._s3_client is client
+
     @pytest.mark.parametrize('pre_client', [True, False])
     @pytest.mark.parametrize(
         ['backend', 'n_workers', 'n'], [
@@ -77,3 +215,56 @@ class TestAws:
         assert len(results) == n
         assert len(s := set(results)) == 1
         self._verify_catalog(get_single(s))
+
+
+class CountingS3Raw(S3Raw):
+    probed = []
+
+    def _test_access(self, client):
+        access_key = client._request_signer._credentials.access_key
+        self.probed.append(access_key)
+        return access_key.startswith('valid_')
+
+
+class FakeS3Client:
+    """An in-memory stand-in for an S3 client, supporting the operations used by S3Raw"""
+    _exceptions = None
+
+    def __init__(self, objects):
+        self.objects = objects
+        if FakeS3Client._exceptions is None:
+            FakeS3Client._exceptions = S3Raw.anonymous(share_client=False)._s3_client.exceptions
+        self.exceptions = FakeS3Client._exceptions
+
+    def _data(self, bucket, key, operation):
+        try:
+            return self.objects[bucket, key]
+        except KeyError:
+            raise ClientError({'Error': {'Code': '404'}}, operation) from None
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        data = self.objects[Bucket, Key]
+        return {'Body': StreamingBody(io.BytesIO(data), len(data))}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self._data(Bucket, Key, 'HeadObject'))}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Bucket, Key] = Body
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None):
+        self.objects[Bucket, Key] = self._data(CopySource['Bucket'], CopySource['Key'], 'HeadObject')
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        # read in small parts, as a multipart upload would
+        data = b''.join(iter(lambda: Fileobj.read(3), b''))
+        self.objects[Bucket, Key] = data
+
+
+def fake_s3(objects=None, **kwargs):
+    s3 = S3Raw(ANONYMOUS, **kwargs)
+    s3._cached_s3_client = FakeS3Client({} if objects is None else objects)
+    s3._cached_s3_client_initialization_pid = os.getpid()
+    return s3
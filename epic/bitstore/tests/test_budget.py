@@ -0,0 +1,73 @@
+import time
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from epic.bitstore import ByteBudget, BlobTooLarge
+
+
+class TestByteBudget:
+    def test_limit(self):
+        budget = ByteBudget(100)
+        sizes = [10, 30, 50, 70, 90] * 10
+
+        def fetch(size):
+            with budget.reserve(size) as reserved:
+                assert reserved == size
+                assert budget.in_flight <= budget.max_bytes
+                time.sleep(0.001)
+
+        with ThreadPoolExecutor(16) as executor:
+            list(executor.map(fetch, sizes))
+        assert budget.in_flight == 0
+        assert 90 <= budget.peak <= 100
+
+    def test_reserve_blob(self):
+        budget = ByteBudget(100)
+        with budget.reserve_blob('store', 'uri', 100) as reserved:
+            assert reserved == 100
+        with pytest.raises(BlobTooLarge):
+            with budget.reserve_blob('store', 'uri', 101):
+                pass
+        assert budget.in_flight == 0
+        with pytest.raises(BlobTooLarge):
+            raise pickle.loads(pickle.dumps(BlobTooLarge('store', 'uri', 101, 100)))
+
+    def test_oversized(self):
+        budget = ByteBudget(100)
+        small = budget.acquire(10)
+        acquired = threading.Event()
+
+        def fetch_large():
+            with budget.reserve(1000) as reserved:
+                assert reserved == 100
+                acquired.set()
+
+        thread = threading.Thread(target=fetch_large)
+        thread.start()
+        # the oversized fetch waits for exclusive use of the budget
+        assert not acquired.wait(0.1)
+        budget.release(small)
+        assert acquired.wait(10)
+        thread.join()
+        assert budget.in_flight == 0
+        assert budget.peak == 100
+
+    def test_iter_chunks(self):
+        budget = ByteBudget(10)
+        chunks = budget.iter_chunks([b'1234', b'5678', b'90'], chunk_size=4)
+        assert next(chunks) == b'1234'
+        assert budget.in_flight == 4
+        assert list(chunks) == [b'5678', b'90']
+        assert budget.in_flight == 0
+
+    def test_pickle(self):
+        budget = ByteBudget(10)
+        budget.acquire(5)
+        copy = pickle.loads(pickle.dumps(budget))
+        assert copy.max_bytes == 10
+        assert copy.in_flight == 0
+        with pytest.raises(ValueError):
+            ByteBudget(0)
@@ -0,0 +1,144 @@
+import os
+import sys
+import socket
+import pickle
+import threading
+
+import pytest
+
+if not hasattr(socket, 'AF_UNIX'):
+    pytest.skip("the daemon requires Unix domain sockets", allow_module_level=True)
+
+from epic.bitstore import Composite, NotFoundInStore, InvalidURI, StoreNotAvailable, RemoteStoreError
+from epic.bitstore.daemon import BlobServer, BlobClient
+
+from .helpers import DictStore
+
+
+class CountingStore(DictStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_gets = 0
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+    def get(self, uri):
+        if uri == 'key:error':
+            raise RuntimeError("oops")
+        self.n_gets += 1
+        self.unblocked.wait()
+        return super().get(uri)
+
+
+class RecordingBlobServer(BlobServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors = []
+        self.n_closed = threading.Semaphore(0)
+
+    def handle_error(self, request, client_address):
+        self.errors.append(sys.exc_info()[1])
+
+    def shutdown_request(self, request):
+        super().shutdown_request(request)
+        self.n_closed.release()
+
+
+def _shared_memory_segments():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+
+@pytest.fixture
+def served(tmp_path):
+    store = CountingStore({'small': b'S', 'large': b'L' * 1000})
+    composite = Composite()
+    composite.append_source(store)
+    server = BlobServer(composite, tmp_path / 'bitstore.sock', shared_memory_threshold=100)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = BlobClient(tmp_path / 'bitstore.sock', timeout=10, uri_regex='^key:')
+    yield store, client
+    client.close()
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+class TestDaemon:
+    def test_get(self, served):
+        store, client = served
+        assert client.is_valid('key:small')
+        assert not client.is_valid('small')
+        assert client.get('key:small') == b'S'
+        assert client.get('key:large') == b'L' * 1000
+        assert client.get('key:large') == b'L' * 1000
+        with pytest.raises(NotFoundInStore):
+            client.get('key:missing')
+        with pytest.raises(InvalidURI):
+            client.get('small')
+        with pytest.raises(RemoteStoreError, match='oops'):
+            client.get('key:error')
+        with pytest.raises(TypeError):
+            client.get(None)
+        assert client.exists('key:small')
+        assert not client.exists('key:missing')
+        with pytest.raises(InvalidURI):
+            client.exists('small')
+        unpickled = pickle.loads(pickle.dumps(client))
+        assert unpickled.get('key:small') == b'S'
+        unpickled.close()
+
+    def test_deduplication(self, served):
+        store, client = served
+        store.unblocked.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.get('key:large'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while store.n_gets == 0:
+            threading.Event().wait(0.01)
+        threading.Event().wait(0.3)
+        store.unblocked.set()
+        for thread in threads:
+            thread.join()
+        assert results == [b'L' * 1000] * 8
+        assert store.n_gets == 1
+
+    def test_not_available(self, tmp_path):
+        client = BlobClient(tmp_path / 'no.sock')
+        assert client.is_valid('key:small')
+        assert not client.is_valid(None)
+        with pytest.raises(StoreNotAvailable):
+            client.get('key:small')
+        # a composite falls back to the next tier when the daemon is down
+        composite = Composite()
+        composite.append_source(client)
+        composite.append_source(DictStore({'small': b'S'}))
+        assert composite.get('key:small') == b'S'
+        assert composite.exists('key:small')
+
+    def test_client_timeout(self, tmp_path):
+        store = CountingStore({'large': b'L' * 1000}, prefix=None)
+        store.unblocked.clear()
+        server = RecordingBlobServer(store, tmp_path / 'bitstore.sock', shared_memory_threshold=100)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        segments = _shared_memory_segments()
+        client = BlobClient(tmp_path / 'bitstore.sock', timeout=0.2)
+        try:
+            with pytest.raises(StoreNotAvailable):
+                client.get('large')
+            # the timed-out connection is closed, rather than left waiting for a response
+            assert not client._sockets
+            store.unblocked.set()
+            # the server finds the client gone, and reclaims the shared memory quietly
+            assert server.n_closed.acquire(timeout=10)
+            assert not server.errors
+            assert _shared_memory_segments() <= segments
+            assert client.get('large') == b'L' * 1000
+            assert len(client._sockets) == 1
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
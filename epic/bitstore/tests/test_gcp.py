@@ -1,12 +1,20 @@
+import io
+import hashlib
+import os
 import random
+import socket
 
 import pytest
 from ultima import ultimap
 from epic.common.general import get_single
 
-from epic.bitstore import GSRaw, Composite, NotFoundInStore, InvalidURI, StoreNotAvailable
+from google.cloud.exceptions import NotFound
+from epic.bitstore import (
+    GSRaw, Composite, ClientConfig, SyncEngine, NotFoundInStore, InvalidURI, StoreNotAvailable, ByteBudget,
+    BlobTooLarge, Sha1Store,
+)
 
-from .helpers import DictStore
+from .helpers import DictStore, ChunkedDictStore
 
 # source: https://cloud.google.com/storage/docs/public-datasets/landsat
 GS_PUBLIC_LANDSAT_URI = "gs://gcp-public-data-landsat/LC08/01/001/003/LC08_L1GT_001003_20140812_20170420_01_T2/" \
@@ -56,6 +64,11 @@ class TestGcp:
         with pytest.raises(StoreNotAvailable):
             gs.put(GS_PUBLIC_LANDSAT_URI, b'data')
 
+    def test_exists(self):
+        gs = GSRaw.anonymous()
+        assert gs.exists(GS_PUBLIC_LANDSAT_URI)
+        assert not gs.exists(f"{GS_PUBLIC_LANDSAT_URI}_{random.random()}")
+
     def test_put(self):
         gs = GSRaw.anonymous()
         with pytest.raises(InvalidURI):
@@ -63,6 +76,65 @@ class TestGcp:
         with pytest.raises(Exception, match="Anonymous credentials cannot be refreshed"):
             gs.put(GS_PUBLIC_LANDSAT_URI, b'data')
 
+    def test_client_config(self):
+        config = ClientConfig(max_pool_connections=32, tcp_keepalive=True, max_attempts=3)
+        gs = GSRaw.anonymous(config=config)
+        adapter = gs._gs_client._http.get_adapter("https://storage.googleapis.com")
+        assert adapter._pool_maxsize == 32
+        assert adapter.max_retries.total == 2
+        assert any(option[1:] == (socket.SO_KEEPALIVE, 1) for option in adapter.socket_options)
+        # stores with the same credentials and configuration share a client
+        assert GSRaw.anonymous(config=config)._gs_client is gs._gs_client
+        assert GSRaw.anonymous()._gs_client is not gs._gs_client
+        assert GSRaw.anonymous(config=config, share_client=False)._gs_client is not gs._gs_client
+
+    def test_copy_to(self):
+        objects = {('bucket', 'a'): b'data'}
+        source, dest = fake_gs(objects), fake_gs(objects)
+        assert source.copy_to('gs://bucket/a', dest, 'gs://other/b')
+        assert objects[('other', 'b')] == b'data'
+        # the rewrite is continued until it is done
+        assert dest._gs_client.n_rewrites == 2
+        with pytest.raises(NotFoundInStore):
+            source.copy_to('gs://bucket/missing', dest, 'gs://other/c')
+        assert not source.copy_to('gs://bucket/a', DictStore(writeable=True, prefix=None), 'gs://other/c')
+
+    def test_put_chunks(self):
+        gs = fake_gs()
+        gs.put_chunks('gs://bucket/a', iter([b'ab', b'cd', b'e']))
+        assert gs._gs_client.objects[('bucket', 'a')] == b'abcde'
+
+        def failing():
+            yield b'ab'
+            raise RuntimeError("stream failed")
+
+        with pytest.raises(RuntimeError):
+            gs.put_chunks('gs://bucket/b', failing())
+        assert ('bucket', 'b') not in gs._gs_client.objects
+        source = ChunkedDictStore({f"gs://bucket/{i}": str(i).encode() * 10 for i in range(5)}, prefix=None)
+        report = SyncEngine(source, gs).run()
+        assert report.copied == 5
+        assert gs._gs_client.objects[('bucket', '3')] == b'3' * 10
+
+    def test_byte_budget(self):
+        small, large = b'x' * 100, b'y' * 1000
+        small_digest, large_digest = hashlib.sha1(small).hexdigest(), hashlib.sha1(large).hexdigest()
+        budget = ByteBudget(100)
+        gs = fake_gs({('bucket', small_digest): small, ('bucket', large_digest): large}, byte_budget=budget)
+        assert gs.size(f'gs://bucket/{large_digest}') == 1000
+        assert gs.get(f'gs://bucket/{small_digest}') == small
+        with pytest.raises(BlobTooLarge):
+            gs.get(f'gs://bucket/{large_digest}')
+        assert b''.join(gs.get_chunks(f'gs://bucket/{large_digest}', chunk_size=30)) == large
+        # a verified get holds the whole blob in memory, so it is subject to the budget as well
+        sha1 = Sha1Store(gs, prefix='gs://bucket/', verify=True)
+        assert sha1.get(small_digest) == small
+        with pytest.raises(BlobTooLarge):
+            sha1.get(large_digest)
+        assert b''.join(sha1.get_chunks(large_digest)) == large
+        assert budget.peak == 100
+        assert budget.in_flight == 0
+
     @pytest.mark.parametrize('pre_client', [True, False])
     @pytest.mark.parametrize(
         ['backend', 'n_workers', 'n'], [
@@ -79,3 +151,81 @@ class TestGcp:
         assert len(results) == n
         assert len(s := set(results)) == 1
         self._verify_landsat(get_single(s))
+
+
+class FakeBlob:
+    def __init__(self, client, bucket_name, name):
+        self.client = client
+        self.key = bucket_name, name
+
+    @property
+    def _data(self):
+        try:
+            return self.client.objects[self.key]
+        except KeyError:
+            raise NotFound(f"{self.key} not found") from None
+
+    @property
+    def size(self):
+        return len(self._data)
+
+    def download_as_bytes(self, **kwargs):
+        return self._data
+
+    def exists(self, **kwargs):
+        return self.key in self.client.objects
+
+    def open(self, mode, chunk_size=None, **kwargs):
+        if mode == 'rb':
+            return io.BytesIO(self._data)
+        return FakeBlobWriter(self)
+
+    def rewrite(self, source, token=None, **kwargs):
+        self.client.n_rewrites += 1
+        data = source._data
+        if token is None:
+            return 'more', 0, len(data)
+        self.client.objects[self.key] = data
+        return None, len(data), len(data)
+
+
+class FakeBlobWriter(io.BytesIO):
+    """Like google's BlobWriter, the upload is cancelled when the context exits with an exception"""
+    def __init__(self, blob):
+        super().__init__()
+        self.blob = blob
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.blob.client.objects[self.blob.key] = self.getvalue()
+        return super().__exit__(exc_type, exc_val, exc_tb)
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self.client, self.name, name)
+
+    def get_blob(self, name, **kwargs):
+        blob = self.blob(name)
+        return blob if blob.exists() else None
+
+
+class FakeGSClient:
+    """An in-memory stand-in for a GCS client, supporting the operations used by GSRaw"""
+    def __init__(self, objects):
+        self.objects = objects
+        self.n_rewrites = 0
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+
+def fake_gs(objects=None, **kwargs):
+    gs = GSRaw.anonymous(**kwargs)
+    gs._cached_gs_client = FakeGSClient({} if objects is None else objects)
+    gs._cached_gs_client_initialization_pid = os.getpid()
+    return gs
@@ -0,0 +1,185 @@
+import pickle
+import hashlib
+
+import pytest
+
+from epic.bitstore import (
+    HashStore, HashComposite, HashCache, Sha1Composite, Sha1Store, AliasIndex, AliasIndexStore, AliasComposite,
+    MemoryCache, InvalidURI, NotFoundInStore, InvalidDataFound,
+)
+
+from .helpers import DictStore, ChunkedDictStore
+
+BLOBS = [b'epic.bitstore', b'another blob', b'and a third one']
+
+
+def digest(data, algorithm):
+    return hashlib.new(algorithm, data).hexdigest()
+
+
+class TestHashed:
+    @pytest.mark.parametrize('algorithm', ['md5', 'sha1', 'sha256'])
+    def test_hash_store(self, algorithm):
+        store = HashStore(ChunkedDictStore(writeable=True), prefix='key:', verify=True, algorithm=algorithm)
+        key = digest(BLOBS[0], algorithm)
+        assert store.is_valid(key)
+        assert store.is_valid(key.upper())
+        assert not store.is_valid(key + 'a')
+        store.put(key.upper(), BLOBS[0])
+        assert store.get(key) == BLOBS[0]
+        with pytest.raises(InvalidDataFound):
+            store.put(key, BLOBS[1])
+        with pytest.raises(InvalidURI):
+            store.get("a" * 41)
+        store.base_store.put(f"key:{key}", BLOBS[1])
+        with pytest.raises(InvalidDataFound):
+            store.get(key)
+
+    def test_blake3(self):
+        blake3 = pytest.importorskip('blake3')
+        store = HashStore(DictStore(writeable=True), prefix='key:', verify=True, algorithm='blake3')
+        key = blake3.blake3(BLOBS[0]).hexdigest()
+        store.put(key, BLOBS[0])
+        assert store.get(key) == BLOBS[0]
+        with pytest.raises(InvalidDataFound):
+            store.put(key, BLOBS[1])
+
+    def test_memory_cache_base(self):
+        store = HashStore(MemoryCache(max_bytes=100), prefix='', algorithm='sha1')
+        key = digest(BLOBS[0], 'sha1')
+        store.put(key, BLOBS[0])
+        assert store.size(key) == len(BLOBS[0])
+        assert store.exists(key)
+
+    def test_algorithm_errors(self):
+        with pytest.raises(ValueError):
+            HashStore(DictStore(), prefix='key:')
+        with pytest.raises(ValueError):
+            HashStore(DictStore(), prefix='key:', algorithm='not_a_hash')
+
+    def test_hash_composite(self):
+        composite = HashComposite('sha256')
+        cache = HashCache(DictStore(writeable=True, prefix='cache'), 'cache:', verify=True, algorithm='sha256')
+        composite.append_cache(cache)
+        store = HashStore(DictStore(writeable=True), prefix='key:', algorithm='sha256')
+        composite.append_source(store, cache_result=True)
+        key = digest(BLOBS[0], 'sha256')
+        store.put(key, BLOBS[0])
+        assert composite.is_valid(key)
+        assert composite.is_valid(f"sha256://{key}")
+        assert not composite.is_valid(f"sha1://{key}")
+        assert not composite.is_valid(digest(BLOBS[0], 'sha1'))
+        assert composite.get(f"sha256://{key.upper()}") == BLOBS[0]
+        assert cache.get(key) == BLOBS[0]
+        # invalid data is silently not cached
+        bad_key = digest(BLOBS[1], 'sha256')
+        store.put(bad_key, BLOBS[2])
+        assert composite.get(bad_key) == BLOBS[2]
+        with pytest.raises(NotFoundInStore):
+            cache.get(bad_key)
+
+    @pytest.mark.parametrize('shard_digits', [0, 1, 2])
+    def test_iter_keys(self, shard_digits):
+        store = HashStore(DictStore(writeable=True), prefix='key:', algorithm='sha1')
+        blobs = {digest(blob, 'sha1'): blob for blob in [str(i).encode() for i in range(300)]}
+        for key, blob in blobs.items():
+            store.put(key, blob)
+        store.base_store.put('key:not_a_digest', b'ignored')
+        infos = list(store.iter_keys(shard_digits=shard_digits, n_workers=4))
+        assert len(infos) == len(blobs)
+        assert {info.key: info.size for info in infos} == {key: len(blob) for key, blob in blobs.items()}
+        assert all(info.etag is not None for info in infos)
+        some_key = next(iter(blobs))
+        keys = {info.key for info in store.iter_keys(prefix=some_key[:2].upper(), shard_digits=shard_digits)}
+        assert keys == {key for key in blobs if key.startswith(some_key[:2])}
+        # sharding stops at the full digest length
+        assert [info.key for info in store.iter_keys(prefix=some_key, shard_digits=shard_digits)] == [some_key]
+        assert [info.key for info in store.iter_keys(prefix=some_key[:39], shard_digits=shard_digits)] == [some_key]
+        for prefix in ['xy', some_key + '0']:
+            with pytest.raises(InvalidURI):
+                list(store.iter_keys(prefix=prefix, shard_digits=shard_digits))
+        # abandoning the iteration does not hang, and does not list the shards which haven't started
+        listed = []
+        base_iter_keys = store.base_store.iter_keys
+
+        def iter_keys(prefix=''):
+            listed.append(prefix)
+            yield from base_iter_keys(prefix)
+
+        store.base_store.iter_keys = iter_keys
+        iterator = store.iter_keys(shard_digits=shard_digits, n_workers=2)
+        next(iterator)
+        iterator.close()
+        assert len(listed) <= 3
+
+    def test_alias_index(self, tmp_path):
+        pairs = [(digest(blob, 'md5'), digest(blob, 'sha1')) for blob in BLOBS]
+        index = AliasIndex.build(tmp_path / 'md5.idx', reversed(pairs))
+        assert len(index) == len(BLOBS)
+        assert index.alias_size == 16 and index.target_size == 20
+        for md5, sha1 in pairs:
+            assert index.lookup(md5) == sha1
+            assert index.lookup(md5.upper()) == sha1
+        assert index.lookup('0' * 32) is None
+        assert index.lookup('f' * 32) is None
+        assert index.lookup('not hex') is None
+        assert index.lookup('0' * 40) is None
+        index = pickle.loads(pickle.dumps(index))
+        assert index.lookup(pairs[1][0]) == pairs[1][1]
+        # rebuilding the file does not affect an index which is already mapped
+        AliasIndex.build(tmp_path / 'md5.idx', pairs[:1])
+        assert len(index) == len(BLOBS)
+        assert index.lookup(pairs[2][0]) == pairs[2][1]
+        assert len(AliasIndex(tmp_path / 'md5.idx')) == 1
+        # sorted externally in runs, with the last target of a repeated alias kept
+        md5s = [digest(str(i).encode(), 'md5') for i in range(10)]
+        chunked = AliasIndex.build(
+            tmp_path / 'chunked.idx', [(md5, '00' * 20) for md5 in md5s] + [(md5s[3], 'ff' * 20)], chunk_size=3,
+        )
+        assert len(chunked) == 10
+        assert chunked.lookup(md5s[3]) == 'ff' * 20
+        assert all(chunked.lookup(md5) == '00' * 20 for md5 in md5s if md5 != md5s[3])
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['chunked.idx', 'md5.idx']
+        empty = AliasIndex.build(tmp_path / 'empty.idx', [])
+        assert len(empty) == 0
+        assert empty.lookup('0' * 32) is None
+        with pytest.raises(ValueError):
+            AliasIndex.build(tmp_path / 'mixed.idx', [('00' * 16, '00' * 20), ('00' * 32, '00' * 20)])
+        (tmp_path / 'garbage.idx').write_bytes(b'garbage')
+        with pytest.raises(ValueError):
+            AliasIndex(tmp_path / 'garbage.idx')
+        with pytest.raises(ValueError):
+            AliasIndexStore(index, 'sha256')
+
+    def test_alias_composite(self, tmp_path):
+        sha1_composite = Sha1Composite()
+        sha1_store = Sha1Store(DictStore(writeable=True), prefix='key:')
+        sha1_composite.append_source(sha1_store)
+        for blob in BLOBS:
+            sha1_store.put(digest(blob, 'sha1'), blob)
+        composite = AliasComposite(sha1_composite)
+        for algorithm in ['md5', 'sha256']:
+            index = AliasIndex.build(
+                tmp_path / f'{algorithm}.idx', [(digest(blob, algorithm), digest(blob, 'sha1')) for blob in BLOBS]
+            )
+            composite.append_alias(AliasIndexStore(index, algorithm))
+        for blob in BLOBS:
+            for algorithm in ['md5', 'sha1', 'sha256']:
+                key = digest(blob, algorithm)
+                assert composite.is_valid(key)
+                assert composite.get(key) == blob
+                assert composite.get(f"{algorithm}://{key}") == blob
+                assert composite.resolve(key) == digest(blob, 'sha1')
+        assert not composite.is_valid('a' * 50)
+        assert not composite.is_valid(f"sha512://{'a' * 128}")
+        assert not composite.is_valid(f"md5://{'a' * 40}")
+        with pytest.raises(InvalidURI):
+            composite.get('a' * 50)
+        with pytest.raises(NotFoundInStore):
+            composite.get('a' * 32)
+        with pytest.raises(NotFoundInStore):
+            composite.get('a' * 40)
+        with pytest.raises(ValueError):
+            composite.append_alias(DictStore())
+        with pytest.raises(ValueError):
+            composite.append_alias(DictStore(), 'sha1')
@@ -0,0 +1,23 @@
+import sys
+import json
+import subprocess
+
+HEAVY_MODULES = ['boto3', 'botocore', 'google.cloud', 'google.auth', 'requests', 'urllib3']
+
+IMPORT_BENCHMARK = f"""
+import sys, json, time
+start = time.perf_counter()
+import epic.bitstore
+elapsed = time.perf_counter() - start
+heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(json.dumps({{'elapsed': elapsed, 'heavy': heavy}}))
+"""
+
+
+class TestImport:
+    def test_import_is_light(self, record_property):
+        # a fresh interpreter is needed, since other tests already imported the SDKs
+        output = subprocess.run([sys.executable, '-c', IMPORT_BENCHMARK], capture_output=True, check=True, text=True)
+        result = json.loads(output.stdout)
+        record_property('import_seconds', result['elapsed'])
+        assert result['heavy'] == []
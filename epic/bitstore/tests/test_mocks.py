@@ -1,10 +1,18 @@
+import time
 import pickle
+import threading
 
 import pytest
 
-from epic.bitstore import NotFoundInStore, InvalidURI, Composite
+from epic.bitstore import (
+    NotFoundInStore, InvalidURI, Composite, ReplicationError, MemoryCache, AdmissionPolicy, DeadlineExceeded,
+    LatencyRecorder,
+)
+from epic.bitstore.store import ChunksIO
+from epic.bitstore import composite as composite_module
+from epic.bitstore.composite import GET_WORKERS
 
-from .helpers import DictStore, RandomAPI
+from .helpers import DictStore, RandomAPI, BlockingDictStore, SlowDictStore, HangingDictStore
 
 
 class TestDictStore:
@@ -31,6 +39,13 @@ class TestDictStore:
         ds.put("key:one", b'111')
         assert ds.get("key:one") == b'111'
 
+    def test_chunks_io(self):
+        stream = ChunksIO(iter([b'abc', b'', b'defg', b'h']))
+        assert stream.read(2) == b'ab'
+        assert stream.read(4) == b'cdef'
+        assert stream.read() == b'gh'
+        assert stream.read(4) == b''
+
     def test_composite(self):
         composite = Composite()
         assert not composite.is_valid("zzz")
@@ -166,3 +181,221 @@ class TestDictStore:
         assert composite.get('key:a') == b'AAA'
         assert cache1.contents['key:a'] == b'A'
         assert cache2.contents['key:a'] == b'AAA'
+
+    def test_put_all(self):
+        ds1, ds2 = DictStore(writeable=True), DictStore(writeable=True)
+        composite = Composite()
+        composite.append_source(ds1, write=True)
+        composite.append_target(ds2)
+        report = composite.put('key:a', b'A')
+        assert set(report.succeeded) == {ds1, ds2}
+        assert not report.failed and not report.pending
+        assert ds1.contents == ds2.contents == {'key:a': b'A'}
+        assert composite.get('key:a') == b'A'
+        with pytest.raises(InvalidURI):
+            composite.put('a', b'A')
+        read_only = DictStore()
+        composite.append_target(read_only)
+        with pytest.raises(ReplicationError) as exc_info:
+            composite.put('key:b', b'B')
+        assert list(exc_info.value.report.failed) == [read_only]
+        assert ds1.contents['key:b'] == ds2.contents['key:b'] == b'B'
+        with pytest.raises(ReplicationError):
+            raise pickle.loads(pickle.dumps(exc_info.value))
+        with pytest.raises(ValueError):
+            Composite(replication='sometimes')
+
+    def test_put_quorum(self):
+        ds1, ds2, slow = DictStore(writeable=True), DictStore(), BlockingDictStore(writeable=True)
+        composite = Composite(replication='quorum', quorum=3)
+        for store in [ds1, ds2, slow]:
+            composite.append_target(store)
+        # a quorum cannot be reached once a single target fails
+        with pytest.raises(ReplicationError):
+            composite.put('key:a', b'A')
+        composite.quorum = 1
+        report = composite.put('key:b', b'B')
+        assert report.succeeded == [ds1]
+        assert slow in report.pending
+        assert 'key:b' not in slow.contents
+        slow.unblocked.set()
+        report.wait(timeout=10)
+        assert not report.pending
+        assert list(report.failed) == [ds2]
+        assert report.succeeded == [ds1, slow]
+        assert slow.contents == {'key:a': b'A', 'key:b': b'B'}
+
+    def test_put_primary(self):
+        primary, replica = DictStore(writeable=True), BlockingDictStore(writeable=True)
+        composite = Composite(replication='primary')
+        composite.append_target(primary)
+        composite.append_target(replica)
+        report = composite.put('key:a', b'A')
+        assert report.succeeded == [primary]
+        assert list(report.pending) == [replica]
+        assert primary.contents == {'key:a': b'A'}
+        replica.unblocked.set()
+        assert report.wait(timeout=10).succeeded == [primary, replica]
+        assert replica.contents == {'key:a': b'A'}
+        primary.writeable = False
+        with pytest.raises(ReplicationError):
+            composite.put('key:b', b'B')
+        assert 'key:b' not in replica.contents
+
+    def test_max_pending_writes(self):
+        primary, replica = DictStore(writeable=True), BlockingDictStore(writeable=True)
+        composite = Composite(replication='primary', max_pending_writes=1)
+        composite.append_target(primary)
+        composite.append_target(replica)
+        composite.put('key:a', b'A')
+        # the second replication waits for the first one, which holds the only slot
+        thread = threading.Thread(target=composite.put, args=('key:b', b'B'))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+        assert primary.contents['key:b'] == b'B'
+        replica.unblocked.set()
+        thread.join(10)
+        assert not thread.is_alive()
+        assert composite.put('key:c', b'C').wait(timeout=10).succeeded == [primary, replica]
+        copy = pickle.loads(pickle.dumps(Composite(max_pending_writes=1)))
+        assert copy._write_slots.acquire(blocking=False)
+        assert not copy._write_slots.acquire(blocking=False)
+
+    def test_memory_cache(self):
+        cache = MemoryCache(max_bytes=10)
+        cache.put('a', b'1234')
+        cache.put('b', b'5678')
+        assert cache.get('a') == b'1234'
+        cache.put('c', b'90')
+        assert len(cache) == 3 and cache.used_bytes == 10
+        # 'b' is the least recently used
+        cache.put('d', b'x')
+        with pytest.raises(NotFoundInStore):
+            cache.get('b')
+        assert cache.get('a') == b'1234'
+        cache.put('e', b'x' * 11)
+        with pytest.raises(NotFoundInStore):
+            cache.get('e')
+        cache.put('a', b'12')
+        assert cache.used_bytes == 5
+        assert cache.size('a') == 2 and cache.exists('a') and not cache.exists('b')
+        with pytest.raises(NotFoundInStore):
+            cache.size('b')
+        cache = pickle.loads(pickle.dumps(cache))
+        assert len(cache) == 0
+        cache.put('a', b'1')
+        assert cache.get('a') == b'1'
+
+    def test_cache_levels(self):
+        memory = MemoryCache(max_bytes=1000)
+        disk = DictStore(writeable=True)
+        regional = DictStore(writeable=True)
+        origin = DictStore({'small': b'S', 'large': b'L' * 100, 'hot': b'H'})
+        composite = Composite()
+        composite.append_cache_level(memory, AdmissionPolicy(max_size=10, min_hits=2))
+        composite.append_cache_level(disk)
+        composite.append_cache_level(regional, AdmissionPolicy(max_size=10))
+        composite.append_source(origin)
+        assert composite.get('key:small') == b'S'
+        assert disk.contents == regional.contents == {'key:small': b'S'}
+        assert len(memory) == 0
+        # the second hit is found in disk, and promoted into memory only
+        assert composite.get('key:small') == b'S'
+        assert memory.get('key:small') == b'S'
+        assert composite.get('key:large') == b'L' * 100
+        assert disk.contents['key:large'] == b'L' * 100
+        assert 'key:large' not in regional.contents
+        regional.put('key:hot', b'H')
+        assert composite.get('key:hot') == b'H'
+        assert disk.contents['key:hot'] == b'H'
+        with pytest.raises(NotFoundInStore):
+            memory.get('key:hot')
+        # a failing level does not fail the get
+        del disk.contents['key:hot']
+        disk.writeable = False
+        assert composite.get('key:hot') == b'H'
+        assert 'key:hot' not in disk.contents
+        assert memory.get('key:hot') == b'H'
+        # levels are still promoted into after pickling (e.g. in worker processes)
+        copy = pickle.loads(pickle.dumps(composite))
+        copy_memory = copy.cache_levels[0][0]
+        assert len(copy_memory) == 0
+        for _ in range(2):
+            assert copy.get('key:small') == b'S'
+        assert copy_memory.get('key:small') == b'S'
+
+    def test_deadline(self):
+        slow = SlowDictStore({'a': b'slow', 'b': b'slow'}, delay=0.5)
+        fast = DictStore({'a': b'fast'})
+        composite = Composite()
+        composite.append_source(slow)
+        composite.append_source(fast)
+        assert composite.get('key:a') == b'slow'
+        # the slow tier is abandoned after half of the budget, and the next tier is tried
+        assert composite.get('key:a', deadline=0.2) == b'fast'
+        with pytest.raises(DeadlineExceeded):
+            composite.get('key:b', deadline=0.2)
+        # when all the tiers respond in time, a missing blob is not found
+        with pytest.raises(NotFoundInStore):
+            composite.get('key:c', deadline=5)
+        # a nested composite gets its share of the budget as its own deadline
+        outer = Composite()
+        outer.append_source(composite)
+        outer.append_source(DictStore({'b': b'outer'}))
+        assert outer.get('key:b', deadline=0.4) == b'outer'
+        assert composite.latencies.count('get') == 5
+        assert composite.latencies.count(fast) == 4
+        assert composite.latencies.percentiles(slow, [0])[0] >= 0.09
+        assert pickle.loads(pickle.dumps(composite)).get('key:a', deadline=0.2) == b'fast'
+
+    def test_deadline_abandoned_calls(self):
+        hanging = HangingDictStore({'a': b'hanging'})
+        composite = Composite()
+        composite.append_source(hanging)
+        composite.append_source(DictStore({'a': b'fast'}))
+        try:
+            # abandoned calls keep their threads, but later gets are not queued behind them
+            for _ in range(GET_WORKERS + 8):
+                assert composite.get('key:a', deadline=0.1) == b'fast'
+            assert composite.get('key:a', deadline=0.5) == b'fast'
+        finally:
+            hanging.unblocked.set()
+
+    def test_deadline_max_overflow_gets(self, monkeypatch):
+        monkeypatch.setattr(composite_module, 'MAX_OVERFLOW_GETS', 2)
+        hanging = HangingDictStore({'a': b'hanging'})
+        composite = Composite()
+        composite.append_source(hanging)
+        composite.append_source(DictStore({'a': b'fast'}))
+        try:
+            for _ in range(GET_WORKERS + 1):
+                assert composite.get('key:a', deadline=0.1) == b'fast'
+            # the last thread is taken by the hanging source, leaving none for the fast one
+            with pytest.raises(DeadlineExceeded):
+                composite.get('key:a', deadline=0.1)
+            # with all the threads held by abandoned calls, sources are skipped right away
+            start = time.monotonic()
+            with pytest.raises(DeadlineExceeded):
+                composite.get('key:a', deadline=10)
+            assert time.monotonic() - start < 1
+            hanging.unblocked.set()
+            # once they finish, the source is tried again
+            while composite._pooled_gets or composite._overflow_gets:
+                time.sleep(0.01)
+            assert composite.get('key:a', deadline=10) == b'hanging'
+        finally:
+            hanging.unblocked.set()
+
+    def test_latency_recorder(self):
+        recorder = LatencyRecorder(max_samples=100)
+        for i in range(1, 201):
+            recorder.record('get', i / 1000)
+        assert recorder.count('get') == 100
+        assert recorder.percentiles('get') == {50: 0.15, 90: 0.19, 99: 0.199}
+        assert recorder.percentiles('other') == {}
+        for i in range(1, 11):
+            recorder.record('small', i)
+        assert recorder.percentiles('small', (0, 25, 50, 100)) == {0: 1, 25: 3, 50: 5, 100: 10}
+        copy = pickle.loads(pickle.dumps(recorder))
+        assert copy.max_samples == 100 and copy.count('get') == 0
@@ -1,10 +1,13 @@
+import random
+
 import pytest
 
 from epic.bitstore import (
-    Sha1Store, Sha1Composite, Sha1Cache, Sha1APISource, InvalidURI, NotFoundInStore, InvalidDataFound
+    Store, Sha1Store, Sha1Composite, Sha1Cache, Sha1APISource, Sha1FormatMixin, VerifySha1Mixin, InvalidURI,
+    NotFoundInStore, InvalidDataFound,
 )
 
-from .helpers import DictStore
+from .helpers import DictStore, ChunkedDictStore
 
 
 class TestSha1:
@@ -25,6 +28,23 @@ class TestSha1:
                 store.put("a" * 40, b'data')
                 assert store.get("a" * 40) == b'data'
 
+    def test_user_mixins(self):
+        # the mixins can be combined with a plain Store, without the hash store classes
+        class Src(Sha1FormatMixin, VerifySha1Mixin, Store):
+            verify = True
+
+            def get(self, sha1):
+                self._check_valid(sha1)
+                return self._verify_data(b'epic.bitstore', sha1)
+
+        src = Src()
+        assert src.is_valid("a" * 40)
+        assert Sha1FormatMixin._SHA1_REGEX.match("a" * 40)
+        assert Sha1Composite.SHA1_URI_REGEX.match("sha1://" + "a" * 40)
+        assert src.get("4bc39c7d87318382feb3cc5a684c767fbd913968") == b'epic.bitstore'
+        with pytest.raises(InvalidDataFound):
+            src.get("a" * 40)
+
     def test_sha1_composite(self):
         sha1_composite = Sha1Composite()
         assert sha1_composite.is_valid("a" * 40)
@@ -65,6 +85,28 @@ class TestSha1:
         with pytest.raises(InvalidDataFound):
             store.get("a" * 40)
 
+    def test_verify_chunks(self):
+        store = Sha1Store(ChunkedDictStore(writeable=True), prefix='key:', verify=True)
+        store.put("4bc39c7d87318382feb3cc5a684c767fbd913968", b'epic.bitstore')
+        assert store.get("4bc39c7d87318382feb3cc5a684c767fbd913968") == b'epic.bitstore'
+        store.base_store.put("key:" + "a" * 40, b'incorrect data')
+        with pytest.raises(InvalidDataFound):
+            store.get("a" * 40)
+        with pytest.raises(NotFoundInStore) as exc_info:
+            store.get("b" * 40)
+        assert not isinstance(exc_info.value, InvalidDataFound)
+
+    def test_verify_sample(self, monkeypatch):
+        store = Sha1Store(DictStore(writeable=True), prefix='key:', verify=True, verify_every=10)
+        with pytest.raises(InvalidDataFound):
+            store.put("a" * 40, b'incorrect data')
+        store.base_store.put("key:" + "a" * 40, b'incorrect data')
+        monkeypatch.setattr(random, 'randrange', lambda n: 1)
+        assert store.get("a" * 40) == b'incorrect data'
+        monkeypatch.setattr(random, 'randrange', lambda n: 0)
+        with pytest.raises(InvalidDataFound):
+            store.get("a" * 40)
+
     def test_sha1_cache(self):
         sha1_composite = Sha1Composite()
         cache_backend = DictStore(writeable=True, prefix='cache')
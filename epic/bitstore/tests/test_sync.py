@@ -0,0 +1,79 @@
+import hashlib
+
+from epic.bitstore import Sha1Store, SyncEngine
+
+from .helpers import DictStore, ChunkedDictStore, CopyingDictStore, StreamingDictStore
+
+BLOBS = [f"blob {i}".encode() for i in range(50)]
+KEYS = [hashlib.sha1(blob).hexdigest() for blob in BLOBS]
+
+
+def make_source(base_class=DictStore):
+    source = Sha1Store(base_class(writeable=True), prefix='key:')
+    for key, blob in zip(KEYS, BLOBS):
+        source.put(key, blob)
+    return source
+
+
+class TestSync:
+    def test_streaming(self):
+        source = make_source()
+        dest = Sha1Store(DictStore(writeable=True, prefix='dest'), prefix='dest:', verify=True)
+        dest.put(KEYS[0], BLOBS[0])
+        report = SyncEngine(source, dest, n_workers=4).run(KEYS + ['a' * 40])
+        assert report.copied == len(KEYS) - 1
+        assert report.skipped == 1
+        assert report.server_side == 0
+        assert list(report.failed) == ['a' * 40]
+        assert report.bytes == sum(map(len, BLOBS[1:]))
+        assert report.bytes_per_second > 0
+        for key, blob in zip(KEYS, BLOBS):
+            assert dest.get(key) == blob
+
+    def test_chunks(self):
+        source = make_source(ChunkedDictStore)
+        source.verify = True
+        source.base_store.put(f"key:{'b' * 40}", b'corrupted')
+        dest = Sha1Store(StreamingDictStore(writeable=True, prefix='dest'), prefix='dest:', verify=True)
+        report = SyncEngine(source, dest, n_workers=4).run(KEYS + ['b' * 40])
+        assert report.copied == len(KEYS)
+        assert report.bytes == sum(map(len, BLOBS))
+        # the blobs are passed to the destination chunk by chunk
+        assert min(dest.base_store.put_chunk_counts) > 1
+        # invalid data fails the upload once the whole stream was hashed
+        assert list(report.failed) == ['b' * 40]
+        assert f"dest:{'b' * 40}" not in dest.base_store.contents
+
+    def test_server_side(self):
+        source = make_source(CopyingDictStore)
+        dest = Sha1Store(DictStore(writeable=True, prefix='dest'), prefix='dest:')
+        report = SyncEngine(source, dest).run(iter(KEYS))
+        assert report.server_side == len(KEYS)
+        assert report.copied == report.bytes == 0
+        assert dest.base_store.contents == {f"dest:{key}": blob for key, blob in zip(KEYS, BLOBS)}
+        report = SyncEngine(source, dest, skip_existing=False, server_side=False).run(KEYS)
+        assert report.copied == len(KEYS)
+
+    def test_checkpoint(self, tmp_path):
+        source = make_source()
+        dest = Sha1Store(DictStore(writeable=True, prefix='dest'), prefix='dest:')
+        checkpoint = tmp_path / 'checkpoint'
+        report = SyncEngine(source, dest, checkpoint=checkpoint).run(KEYS[:20])
+        assert report.copied == 20
+        assert sorted(checkpoint.read_text().split()) == sorted(KEYS[:20])
+        # keys in the checkpoint are skipped without accessing the stores
+        dest.base_store.contents.clear()
+        report = SyncEngine(source, dest, checkpoint=checkpoint).run(KEYS)
+        assert report.skipped == 20
+        assert report.copied == len(KEYS) - 20
+        assert len(dest.base_store.contents) == len(KEYS) - 20
+        assert sorted(checkpoint.read_text().split()) == sorted(KEYS)
+
+    def test_listing(self):
+        source = make_source()
+        dest = Sha1Store(DictStore(writeable=True, prefix='dest'), prefix='dest:')
+        report = SyncEngine(source, dest).run(prefix=KEYS[0][0])
+        assert report.copied == len([key for key in KEYS if key[0] == KEYS[0][0]])
+        report = SyncEngine(source, dest).run()
+        assert report.copied + report.skipped == len(KEYS)
+        assert len(dest.base_store.contents) == len(KEYS)